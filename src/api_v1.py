@@ -1,6 +1,6 @@
 # api_v1.py
 
-from flask import Flask, jsonify, request, Blueprint
+from flask import Flask, Response, jsonify, request, stream_with_context, Blueprint
 import inspect
 
 import backup
@@ -8,6 +8,7 @@ import helpers
 import jobber
 import player
 import server
+import storage
 import world
 
 api = Blueprint('api-v1', __name__, url_prefix='/api-v1')
@@ -109,14 +110,21 @@ def create_backup():  # 1011
         overwrite = request.json.get('overwrite')
         description = request.json.get('description')
         compress = request.json.get('compress')
+        workers = request.json.get('workers')
+        hot = request.json.get('hot')
+        chunked = request.json.get('chunked')
     except Exception as e:
         return _get_response(['you need a readable json-body', 1011])
-    return _get_response(backup.create(server_name, level_name, backup_name, overwrite, description, compress))
+    return _get_response(backup.create(server_name, level_name, backup_name, overwrite, description, compress, workers, hot, chunked))
     
 @api.route('/get-backup-list', methods=['GET', 'POST'])
 def get_backup_list():  # 1012
     return _get_response(backup.list())
 
+@api.route('/get-backup-summary', methods=['GET', 'POST'])
+def get_backup_summary():  # 1033
+    return _get_response(backup.summary())
+
 @api.route('/restore-backup', methods=['POST'])
 def restore_backup():  # 1013
     try:
@@ -170,7 +178,17 @@ def get_server_details():  # 1019
 
 @api.route('/backup-all-server', methods=['GET', 'POST'])
 def backup_all_server():  # 1020
-    return _get_response(backup.all_server())
+    hot = False
+    workers = None
+    max_bandwidth = None
+    if request.method == 'POST':
+        try:
+            hot = request.json.get('hot')
+            workers = request.json.get('workers')
+            max_bandwidth = request.json.get('max-bandwidth')
+        except Exception as e:
+            return _get_response(['you need a readable json-body', 1020])
+    return _get_response(backup.all_server(hot, workers, max_bandwidth))
 
 @api.route('/update-server', methods=['POST'])
 def update_server():  # 1021
@@ -185,6 +203,102 @@ def update_server():  # 1021
 def update_all_server():  # 1022
     return _get_response(server.update_all())
 
+@api.route('/rebuild-backup-catalog', methods=['GET', 'POST'])
+def rebuild_backup_catalog():  # 1023
+    return _get_response(backup.rebuild_catalog())
+
+@api.route('/remove-backups', methods=['POST'])
+def remove_backups():  # 1024
+    try:
+        backup_names = request.json.get('backup-names')
+    except Exception as e:
+        return _get_response(['you need a readable json-body', 1024])
+    return _get_response(backup.remove_batch(backup_names))
+
+@api.route('/migrate-backup-store', methods=['GET', 'POST'])
+def migrate_backup_store():  # 1025
+    return _get_response(storage.start_migration())
+
+@api.route('/restore-all', methods=['POST'])
+def restore_all():  # 1026
+    try:
+        server_names = request.json.get('server-names')
+        max_bandwidth = request.json.get('max-bandwidth')
+        workers = request.json.get('workers')
+    except Exception as e:
+        return _get_response(['you need a readable json-body', 1026])
+    return _get_response(backup.restore_all(server_names, max_bandwidth, workers))
+
+@api.route('/get-restore-all-progress', methods=['GET', 'POST'])
+def get_restore_all_progress():  # 1027
+    return _get_response(backup.restore_all_progress())
+
+@api.route('/verify-backups', methods=['GET', 'POST'])
+def verify_backups():  # 1028
+    max_bandwidth = None
+    workers = None
+    time_limit = None
+    resume = True
+    if request.method == 'POST':
+        try:
+            max_bandwidth = request.json.get('max-bandwidth')
+            workers = request.json.get('workers')
+            time_limit = request.json.get('time-limit')
+            resume = request.json.get('resume', True)
+        except Exception as e:
+            return _get_response(['you need a readable json-body', 1028])
+    return _get_response(backup.verify(max_bandwidth, workers, time_limit, resume))
+
+@api.route('/migrate-hash-algorithm', methods=['GET', 'POST'])
+def migrate_hash_algorithm():  # 1029
+    return _get_response(backup.start_hash_migration())
+
+@api.route('/prune-backups', methods=['GET', 'POST'])
+def prune_backups():  # 1030
+    # GET is always a dry-run
+    server_names = None
+    policy = None
+    dry_run = True
+    if request.method == 'POST':
+        try:
+            server_names = request.json.get('server-names')
+            policy = request.json.get('policy')
+            dry_run = request.json.get('dry-run', False)
+        except Exception as e:
+            return _get_response(['you need a readable json-body', 1030])
+    return _get_response(backup.prune(server_names, policy, dry_run))
+
+@api.route('/export-backup', methods=['GET', 'POST'])
+def export_backup():  # 1031
+    # the archive is streamed with chunked transfer-encoding. GET takes the parameters as query-string
+    parameters = request.args
+    if request.method == 'POST':
+        try:
+            parameters = request.json
+        except Exception as e:
+            return _get_response(['you need a readable json-body', 1031])
+    result = backup.export_archive(parameters.get('backup-name'), parameters.get('format'))
+    if result[1] > 0:
+        return _get_response(result)
+    return Response(
+        stream_with_context(result[0]['content']),
+        mimetype='application/x-tar' if result[0]['file-name'].endswith('.tar') else 'application/octet-stream',
+        headers={'Content-Disposition': f"attachment; filename=\"{result[0]['file-name']}\""}
+    )
+
+@api.route('/import-backup', methods=['POST'])
+def import_backup():  # 1032
+    # the body is the archive itself and is read while it is uploaded, the parameters are given as query-string
+    return _get_response(backup.import_archive(
+        request.stream,
+        request.args.get('format'),
+        request.args.get('backup-name'),
+        request.args.get('server-name'),
+        request.args.get('level-name'),
+        request.args.get('overwrite'),
+        request.args.get('compress')
+    ))
+
 # JOBBER ###################################################################################
 @api.route('/start-jobber', methods=['GET', 'POST'])
 def start_jobber():  # 1040
@@ -5,6 +5,7 @@ from flask import Flask, Blueprint
 import api_v1
 import os
 import settings
+import storage
 
 # create download-path
 if not os.path.exists(settings.DOWNLOADED_PATH):
@@ -31,11 +32,19 @@ if not os.path.exists(settings.INCREMENTAL_PATH):
     os.mkdir(settings.INCREMENTAL_PATH)
     os.chmod(settings.INCREMENTAL_PATH, 0o777)
 
+# create backup-hash-cache-path
+if not os.path.exists(settings.HASH_CACHE_PATH):
+    os.mkdir(settings.HASH_CACHE_PATH)
+    os.chmod(settings.HASH_CACHE_PATH, 0o777)
+
 # create jobber-socket-path
 if not os.path.exists(settings.JOBBER_SOCKET_PATH):
     os.mkdir(settings.JOBBER_SOCKET_PATH)
     os.chmod(settings.JOBBER_SOCKET_PATH, 0o777)
 
+# move blobs of the flat backup-store into the fan-out layout in the background, once
+storage.start_migration(True)
+
 app = Flask(__name__)
 app.register_blueprint(api_v1.api)
 
@@ -1,19 +1,45 @@
 # backup.py
 # err:2xxx
 
-import gzip
-import hashlib
+import concurrent.futures
 import logging
 import os
 import shutil
+import string
+import tarfile
+import threading
 import time
+import types
+import zipfile
 
+import catalog
+import compression
 import helpers
 import server
 import settings
+import storage
 import world
 
-def create(server_name=None, level_name=None, backup_name=None, overwrite=False, description=None, compress=False):  #201x
+MANIFEST_VERSION = 4
+CHUNKED = 'chunked'  # codec of a file that is stored as chunks
+HASH_CACHE_VERSION = 1
+RESTORE_PROGRESS_FILE = 'restore-all.json'
+SCRUB_STATE_FILE = 'scrub.json'
+ARCHIVE_FORMATS = ['tar', 'mcworld']
+ARCHIVE_MANIFEST = 'backup.properties'  # the metadata in an exported tar, the files of the world are in world/
+ARCHIVE_METADATA = ['server-name', 'level-name', 'backup-name', 'datetime', 'description', 'version']  # taken from an imported manifest
+RETENTION_PERIODS = {  # period: time-format, a backup is kept for each of the newest periods
+    'hourly': '%Y-%m-%d %H',
+    'daily': '%Y-%m-%d',
+    'weekly': '%G-%V',
+    'monthly': '%Y-%m'
+}
+
+_hash_migration_lock = threading.Lock()
+HASH_CACHE_RACY_NS = 2 * 1000 * 1000 * 1000
+
+def create(server_name=None, level_name=None, backup_name=None, overwrite=False, description=None, compress=False, workers=None, hot=False, chunked=None, limiter=None):  #201x, 2161
+    # limiter: helpers.create_throttle() shared with other backups
     if helpers.is_empty(server_name):
         return 'server-name is required', 2011
 
@@ -24,9 +50,10 @@ def create(server_name=None, level_name=None, backup_name=None, overwrite=False,
     result = world.is_running(server_name, level_name)
     if result[1] > 0:
         return 'error by running-check', 2013, result
-    elif result[0]['state']:
+    elif result[0]['state'] and not helpers.is_true(hot):
         return 'world is in use', 2014
     level_name = result[0]['level-name']
+    running = result[0]['state']
 
     current_time = time.time()
     if helpers.is_empty(backup_name):
@@ -38,144 +65,593 @@ def create(server_name=None, level_name=None, backup_name=None, overwrite=False,
     if os.path.exists(backup_file) and not helpers.is_true(overwrite):
         return 'backup with this name already exists', 2015, result
 
-    backup_properties = {
+    result = compression.parse(compress)
+    if result[1] > 0:
+        return 'invalid compress', 2019, result
+    codec = result[0]
+
+    algorithm = settings.HASH_ALGORITHM
+    if algorithm not in storage.HASH_ALGORITHMS:
+        return f"unknown hash-algorithm '{algorithm}'", 2010
+    chunked = settings.BACKUP_CHUNKING if chunked in [None, ''] else helpers.is_true(chunked)
+
+    metadata = {
         'server-name': server_name,
         'level-name': level_name,
         'backup-name': backup_name,
         'datetime': time.strftime('%Y-%m-%d %H:%M', time.localtime(current_time)),
         'description': description
     }
-    result_properties = backup_properties.copy()
+    result_properties = metadata.copy()
     result_properties['file-count'] = 0
+    result_properties['cached-count'] = 0
+    result_properties['hot'] = running
 
     result = server.get_version(server_name)
-    backup_properties['version'] = result[0]['version'] if result[1] == 0 else 'unknown'
+    metadata['version'] = result[0]['version'] if result[1] == 0 else 'unknown'
+    metadata['hash-algorithm'] = algorithm
 
     world_path = os.path.join(server_path, 'worlds', level_name)
+    hash_cache = _read_hash_cache(server_name, level_name)
+    new_hash_cache = {}
+    files = []
+
+    lengths = {}  # hot backup: the files of a running world are only valid up to these lengths
+
+    def store_world_file(relative_file_path):
+        input_file = os.path.join(world_path, relative_file_path)
+        stat = os.stat(input_file)
+        stat_key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        length = lengths.get(relative_file_path, stat.st_size)
+        if length > stat.st_size:
+            raise ValueError(f'{relative_file_path} is shorter than reported by the server')
+        chunk_file = chunked and length >= settings.CHUNKING_MIN_FILE_SIZE
+        cached = hash_cache.get(relative_file_path)
+        is_cached = length == stat.st_size and bool(cached) and cached[:3] == stat_key \
+            and storage.key_algorithm(cached[3]) == algorithm and (len(cached) > 4) == chunk_file \
+            and all(storage.exists(blob['hash']) for blob in _blobs_of(_cached_entry(cached)))
+        entry = _cached_entry(cached) if is_cached else _store_file(input_file, length, codec, algorithm, chunk_file, limiter)
+        entry.update({
+            'path': relative_file_path,
+            'size': length,
+            'cached': is_cached,
+            'stat-key': stat_key if length == stat.st_size and _is_cacheable(input_file, stat_key) else None
+        })
+        return entry
+
+    if running:
+        result = _hold_world(server_name, level_name)
+        if result[1] > 0:
+            return 'cannot hold world for a hot backup', 2161, result
+        lengths = result[0]
+
     try:
-        for root, _, files in os.walk(world_path):
-            for file in files:
-                input_file = os.path.join(root, file)
-                relative_file_path = os.path.relpath(input_file, world_path)
-                with open(input_file, 'rb') as f:
-                    file_hash = hashlib.sha512(f.read()).hexdigest()
-                backup_properties[file_hash] = relative_file_path
+        relative_file_paths = sorted(
+            os.path.relpath(os.path.join(root, file), world_path)
+            for root, _, file_names in os.walk(world_path) for file in file_names
+        )
+        if running:
+            # files of the database which the server did not list are obsolete and get deleted by it,
+            # files outside of the database (packs, icon, ...) are not written while running
+            relative_file_paths = sorted(set(lengths).union(
+                path for path in relative_file_paths if not path.startswith('db' + os.sep)
+            ))
+        workers = settings.BACKUP_WORKERS if workers in [None, ''] else int(workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # map() keeps the order of the sorted paths, so the backup-file is always written the same way
+            for entry in executor.map(store_world_file, relative_file_paths):
+                files.append(entry)
                 result_properties['file-count'] += 1
-                output_file = os.path.join(settings.INCREMENTAL_PATH, file_hash)
-                if not os.path.exists(output_file):
-                    if helpers.is_true(compress):
-                        with open(input_file, 'rb') as f_in:
-                            with gzip.open(output_file, 'wb') as f_out:
-                                shutil.copyfileobj(f_in, f_out)
-                    else:
-                        shutil.copy(input_file, output_file)
+                if entry.pop('cached'):
+                    result_properties['cached-count'] += 1
+                stat_key = entry.pop('stat-key')
+                if stat_key:
+                    new_hash_cache[entry['path']] = _hash_cache_entry(stat_key, entry)
     except Exception as e:
         logging.error(f"unexpected error: {e}")
         return str(e), 2016
+    finally:
+        if running:
+            server.resume_save(server_name)
+
+    # blobs which already existed keep the codec they were stored with
+    result = _resolve_blob_details(files)
+    if result[1] > 0:
+        return 'cannot resolve stored blobs', 2017, result
 
     # write backup
-    result = helpers.write_properties(backup_file, backup_properties)
+    result = _write_manifest(backup_file, metadata, files)
     if result[1] > 0:
         return 'error at write backup', 2018, result
+    _write_hash_cache(server_name, level_name, new_hash_cache)
+
+    # a failed catalog-update is repaired by the next sync, the backup-file is the reference
+    result = catalog.add_backup(backup_name, {key: str(value) for key, value in metadata.items()}, files, os.stat(backup_file).st_mtime_ns)
+    if result[1] > 0:
+        logging.error(f"cannot add backup to catalog: {result[0]}")
+    else:
+        storage.remove(result[0])  # blobs only used by an overwritten backup
     
     helpers.change_permissions_recursive(settings.BACKUPS_PATH, 0o777)
     return result_properties, 0
 
-def restore(backup_name=None, server_name=None, level_name=None):  # 202x
+def restore(backup_name=None, server_name=None, level_name=None, limiter=None, progress=None):  # 202x
+    # limiter: helpers.create_throttle() shared with other restores, progress: called as progress(files-done, files-total, bytes-written)
     if helpers.is_empty(backup_name):
         return 'backup-name is required', 2021
     
     result = _get_backup_by_name(backup_name)
     if result[1] > 0:
         return 'backup does not exists', 2022, result
+    backup_file = os.path.join(settings.BACKUPS_PATH, result[0]['backup-file'])
     
-    result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, result[0]['backup-file']))
+    result = _read_manifest(backup_file)
     if result[1] > 0:
-        return 'cannot read backup-details', 2023
-    properties = result[0]
+        return 'cannot read backup-details', 2023, result
+    metadata = result[0]['metadata']
+    files = result[0]['files']
 
     if helpers.is_empty(server_name):
-        server_name = properties['server-name']
+        server_name = metadata['server-name']
     
     server_path = os.path.join(settings.SERVER_PATH, server_name)
     if not os.path.exists(server_path):
         return f'server not exists: {server_name}', 2024
 
     if helpers.is_empty(level_name):
-        level_name = properties['level-name']
+        level_name = metadata['level-name']
+    if not _is_plain_name(server_name) or not _is_plain_name(level_name) or not all(_is_safe_path(entry['path']) for entry in files):
+        return 'backup leads outside of the world', 2027
 
     result = world.is_running(server_name, level_name)
     if result[1] == 0 and result[0]['state']:
         return 'world is in use', 2025
 
     # begin restoring
-    for sha512 in properties.items():
-        if len(sha512) == 128 and not os.path.exists(os.path.join(settings.INCREMENTAL_PATH, sha512)):
+    for entry in files:
+        if not all(storage.exists(blob['hash']) for blob in _blobs_of(entry)):
             return 'backup is corrupt. you should delete it.', 2026
 
-    world_path = os.path.join(server_path, 'worlds', level_name)
-    if os.path.exists(world_path):
-        # remove old existing world
-        result = helpers.remove_dirtree(world_path)
+    # backup-files written before the codec was recorded are upgraded once
+    upgrade = any(entry['codec'] is None for entry in files)
+    if upgrade:
+        result = _resolve_blob_details(files)
         if result[1] > 0:
-            return 'cannot remove world', 2027, result
+            return 'cannot resolve stored blobs', 2029, result
+
+    world_path = os.path.join(server_path, 'worlds', level_name)
+    hash_cache = _read_hash_cache(server_name, level_name)
+    wanted = {entry['path']: entry for entry in files}
+    start_time = time.time()
+    strategies = {}
+    states = {
+        'files-written': 0,
+        'files-skipped': 0,
+        'files-removed': 0,
+        'bytes-written': 0,
+        'bytes-skipped': 0
+    }
 
-    def is_gzip_file(file_path):
+    def is_restored(entry, current_file):
+        # True, if the current file has already the content of the backup
         try:
-            with gzip.open(file_path, 'rb') as f:
-                f.read(1)
-                return True
-        except Exception as e:
+            stat = os.stat(current_file)
+        except FileNotFoundError:
             return False
-    
+        if entry['path'] == 'levelname.txt':
+            with open(current_file, 'rb') as level_file:
+                return level_file.read() == level_name.encode()
+        if entry['size'] is not None and stat.st_size != entry['size']:
+            return False
+        cached = hash_cache.get(entry['path'])
+        if cached and cached[:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+            return cached[3] == entry['hash']
+        return storage.hash_file(current_file, storage.key_algorithm(entry['hash'])) == entry['hash']
+
+    def restore_world_file(entry):
+        # returns (strategy, size), strategy is None for unchanged files. the size of entries of backup-files
+        # without sizes is set, so the upgraded backup-file gets it
+        output_file = os.path.join(world_path, entry['path'])
+        if entry['size'] is None and entry['path'] == 'levelname.txt':
+            with storage.read_blob(entry['hash'], entry['codec']) as f_in:  # may differ from the restored level-name
+                entry['size'] = len(f_in.read())
+        if is_restored(entry, output_file):
+            size = os.path.getsize(output_file)
+            if entry['size'] is None:
+                entry['size'] = size
+            return None, size
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        if entry['path'] == 'levelname.txt':
+            with open(output_file, 'w') as level_file:
+                level_file.write(level_name)
+            return 'write', len(level_name.encode())
+        if entry['codec'] == CHUNKED:
+            strategy, entry['size'] = storage.copy_chunks(_content_of(entry), output_file, limiter)
+        else:
+            strategy, entry['size'] = storage.copy_blob(entry['hash'], entry['codec'], output_file, limiter)
+        return strategy, entry['size']
+
     try:
-        for sha512, file_name in properties.items():
-            if len(sha512) == 128:
-                output_file = os.path.join(world_path, file_name.strip())
-                if not os.path.exists(os.path.dirname(output_file)):
-                    os.makedirs(os.path.dirname(output_file))
-
-                input_file = os.path.join(settings.INCREMENTAL_PATH, sha512)
-                if is_gzip_file(input_file):
-                    with gzip.open(input_file, 'rb') as f_in:
-                        with open(output_file, 'wb') as f_out:
-                            shutil.copyfileobj(f_in, f_out)
-                else:
-                    shutil.copy(input_file, output_file)
+        # remove the files which are not part of the backup
+        for root, _, file_names in os.walk(world_path, topdown=False):
+            for file_name in file_names:
+                if os.path.relpath(os.path.join(root, file_name), world_path) not in wanted:
+                    os.remove(os.path.join(root, file_name))
+                    states['files-removed'] += 1
+            if root != world_path and len(os.listdir(root)) == 0:
+                os.rmdir(root)
 
-                if file_name == 'levelname.txt':
-                    with open(output_file, 'w') as level_file:
-                        level_file.write(level_name)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, settings.BACKUP_WORKERS)) as executor:
+            for entry, (strategy, size) in zip(files, executor.map(restore_world_file, files)):
+                states['files-written' if strategy else 'files-skipped'] += 1
+                states['bytes-written' if strategy else 'bytes-skipped'] += size
+                if strategy:
+                    strategies[entry['path']] = strategy
+                if progress is not None:
+                    progress(states['files-written'] + states['files-skipped'], len(files), states['bytes-written'])
     except Exception as e:
         logging.error(f"unexpected error: {e}")
         return str(e), 2028
+
+    # the restored files are known now, levelname.txt differs from the backup when restored under another name
+    new_hash_cache = {}
+    for entry in files:
+        restored_file = os.path.join(world_path, entry['path'])
+        stat = os.stat(restored_file)
+        stat_key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        if (entry['path'] != 'levelname.txt' or level_name == metadata['level-name']) and _is_cacheable(restored_file, stat_key):
+            new_hash_cache[entry['path']] = _hash_cache_entry(stat_key, entry)
+    _write_hash_cache(server_name, level_name, new_hash_cache)
+
+    if upgrade:
+        result = _write_manifest(backup_file, metadata, files)
+        if result[1] > 0:
+            logging.error(f"cannot upgrade backup-file: {result[0]}")
     
     helpers.change_permissions_recursive(world_path, 0o777)
-    return {
+    result_properties = {
         'server-name': server_name,
         'backup-name': backup_name,
         'level-name': level_name,
         'state': 'restored'
+    }
+    result_properties.update(states)
+    result_properties['strategies'] = strategies
+    result_properties['times'] = round(time.time() - start_time, 3)
+    return result_properties, 0
+
+def restore_all(server_names=None, max_bandwidth=None, workers=None):  # 217x
+    # restores the newest backup of every server and level, for example after the loss of a host
+    start_time = time.time()
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2171, result
+    result = catalog.latest_backups()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2172, result
+    latest_backups = result[0]
+    if not helpers.is_empty(server_names):
+        server_names = [server_names] if isinstance(server_names, str) else server_names
+        latest_backups = [latest for latest in latest_backups if latest['server-name'] in server_names]
+
+    max_bandwidth = settings.RESTORE_MAX_BANDWIDTH if max_bandwidth in [None, ''] else int(max_bandwidth)
+    workers = settings.RESTORE_ALL_WORKERS if workers in [None, ''] else int(workers)
+    limiter = helpers.create_throttle(max_bandwidth)
+    progress = {
+        f"{latest['server-name']}/{latest['level-name']}": {
+            'backup-name': latest['backup-name'],
+            'state': 'queued',
+            'files-done': 0,
+            'files-total': 0,
+            'bytes-written': 0
+        } for latest in latest_backups
+    }
+    progress_lock = threading.Lock()
+    last_write = 0
+
+    def write_progress(force=False):
+        # other processes (api, cli) read the progress from a file, it is written at most once per second
+        nonlocal last_write
+        with progress_lock:
+            if force or time.time() - last_write >= 1:
+                last_write = time.time()
+                helpers.write_json_atomic(os.path.join(settings.BACKUPS_PATH, RESTORE_PROGRESS_FILE), progress)
+
+    def restore_latest(latest):
+        key = f"{latest['server-name']}/{latest['level-name']}"
+
+        def update(files_done, files_total, bytes_written):
+            progress[key].update({'files-done': files_done, 'files-total': files_total, 'bytes-written': bytes_written})
+            write_progress()
+
+        progress[key]['state'] = 'restoring'
+        write_progress(True)
+        result = restore(latest['backup-file'], latest['server-name'], latest['level-name'], limiter, update)
+        progress[key]['state'] = 'restored' if result[1] == 0 else 'failed'
+        write_progress(True)
+        return key, result
+
+    states = {
+        'restored': {},
+        'failed': {},
+        'bytes-written': 0
+    }
+    write_progress(True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for key, result in executor.map(restore_latest, latest_backups):
+            if result[1] == 0:
+                states['restored'][key] = progress[key]['backup-name']
+                states['bytes-written'] += result[0]['bytes-written']
+            else:
+                states['failed'][key] = result
+    states['times'] = round(time.time() - start_time, 3)
+    return states, 0
+
+def restore_all_progress():  # 218x
+    progress_file = os.path.join(settings.BACKUPS_PATH, RESTORE_PROGRESS_FILE)
+    if not os.path.exists(progress_file):
+        return {}, 0
+    result = helpers.read_json(progress_file)
+    if result[1] > 0:
+        return 'cannot read progress', 2181, result
+    return result[0], 0
+
+def verify(max_bandwidth=None, workers=None, time_limit=None, resume=True):  # 219x
+    # hashes every referenced blob again. the scrub-state remembers how far a pass got, so a pass which
+    # was stopped (time_limit, restart, crash) is continued by the next call
+    start_time = time.time()
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2191, result
+    result = catalog.list_blobs()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2192, result
+    blobs = result[0]
+
+    state_file = os.path.join(settings.BACKUPS_PATH, SCRUB_STATE_FILE)
+    state = None
+    if helpers.is_true(resume) and os.path.exists(state_file):
+        result = helpers.read_json(state_file)
+        if result[1] == 0 and not result[0].get('finished', True):
+            state = result[0]
+    if state is None:
+        state = {
+            'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'cursor': '',  # every blob up to this hash is verified in this pass
+            'corrupt': [],
+            'missing': [],
+            'finished': False
+        }
+    pending = [(file_hash, codec) for file_hash, codec in blobs if file_hash > state['cursor']]
+
+    max_bandwidth = settings.SCRUB_MAX_BANDWIDTH if max_bandwidth in [None, ''] else int(max_bandwidth)
+    workers = settings.SCRUB_WORKERS if workers in [None, ''] else int(workers)
+    deadline = None if time_limit in [None, ''] else start_time + float(time_limit)
+    limiter = helpers.create_throttle(max_bandwidth)
+
+    def verify_blob(blob):
+        file_hash, codec = blob
+        if deadline is not None and time.time() > deadline:
+            return None
+        if codec is None:
+            try:
+                codec = storage.detect_codec(file_hash)
+            except FileNotFoundError:
+                return 'missing'
+        return storage.verify_blob(file_hash, codec, limiter)
+
+    verified = 0
+    last_write = time.time()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            # map() returns in order of the hashes, so the cursor only passes verified blobs
+            for (file_hash, _), blob_state in zip(pending, executor.map(verify_blob, pending)):
+                if blob_state is None:
+                    break  # time-limit reached, the rest is verified by the next call
+                if blob_state != 'ok':
+                    state[blob_state].append(file_hash)
+                state['cursor'] = file_hash
+                verified += 1
+                if time.time() - last_write >= 10:
+                    last_write = time.time()
+                    helpers.write_json_atomic(state_file, state)
+    except Exception as e:
+        logging.error(f"unexpected error: {e}")
+        helpers.write_json_atomic(state_file, state)
+        return str(e), 2193
+    state['finished'] = verified == len(pending)
+    helpers.write_json_atomic(state_file, state)
+
+    result = catalog.find_files(state['corrupt'] + state['missing'])
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2194, result
+    backups = {}
+    for blob_state in ['corrupt', 'missing']:
+        for file_hash in state[blob_state]:
+            for backup_file, path in result[0].get(file_hash, []):
+                backups.setdefault(backup_file, {'corrupt': [], 'missing': []})[blob_state].append(path)
+    return {
+        'started': state['started'],
+        'finished': state['finished'],
+        'blobs-total': len(blobs),
+        'blobs-verified': verified,
+        'blobs-remaining': len(pending) - verified,
+        'corrupt': len(state['corrupt']),
+        'missing': len(state['missing']),
+        'backups': backups,
+        'times': round(time.time() - start_time, 3)
+    }, 0
+
+def export_archive(backup_name=None, archive_format='tar'):  # 226x
+    # returns a generator of a self-contained tar or .mcworld of the backup. it is built from the blobs
+    # while it is sent, so there is no temp-file and the memory stays at a few blocks for any world-size
+    if helpers.is_empty(backup_name):
+        return 'backup-name is required', 2261
+    archive_format = 'tar' if helpers.is_empty(archive_format) else archive_format
+    if archive_format not in ARCHIVE_FORMATS:
+        return f"unknown archive-format '{archive_format}', available: {', '.join(ARCHIVE_FORMATS)}", 2262
+
+    result = _get_backup_by_name(backup_name)
+    if result[1] > 0:
+        return 'backup does not exists', 2263, result
+    backup_info = result[0]
+    result = _read_manifest(os.path.join(settings.BACKUPS_PATH, backup_info['backup-file']))
+    if result[1] > 0:
+        return 'cannot read backup-details', 2264, result
+    metadata = result[0]['metadata']
+    files = result[0]['files']
+
+    for entry in files:
+        if not all(storage.exists(blob['hash']) for blob in _blobs_of(entry)):
+            return 'backup is corrupt. you should delete it.', 2265
+    result = _resolve_blob_details(files)
+    if result[1] > 0:
+        return 'cannot resolve stored blobs', 2266, result
+    try:
+        for entry in files:
+            if entry['size'] is None:  # not recorded by backup-files of version 1, a tar-header needs it in advance
+                entry['size'] = sum(len(data) for data in storage.iter_content(_content_of(entry)))
+    except Exception as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2267
+
+    return {
+        'backup-name': backup_info['backup-name'],
+        'file-name': f"{backup_info['backup-name']}.{archive_format}",
+        'content': _export_tar(metadata, files) if archive_format == 'tar' else _export_mcworld(metadata, files)
     }, 0
 
+def import_archive(stream=None, archive_format='tar', backup_name=None, server_name=None, level_name=None, overwrite=False, compress=False):  # 227x
+    # stores the files of an archive from a readable stream into the backup-store, deduplicated like every backup.
+    # a tar is read member by member. a .mcworld is spooled to a temp-file, because a zip has its directory at the end
+    if stream is None:
+        return 'archive is required', 2271
+    archive_format = 'tar' if helpers.is_empty(archive_format) else archive_format
+    if archive_format not in ARCHIVE_FORMATS:
+        return f"unknown archive-format '{archive_format}', available: {', '.join(ARCHIVE_FORMATS)}", 2272
+    if archive_format == 'mcworld' and helpers.is_empty(server_name):
+        return 'server-name is required', 2275
+    if not helpers.is_empty(backup_name) and os.path.exists(os.path.join(settings.BACKUPS_PATH, backup_name + '.properties')) and not helpers.is_true(overwrite):
+        return 'backup with this name already exists', 2276
+
+    result = compression.parse(compress)
+    if result[1] > 0:
+        return 'invalid compress', 2273, result
+    codec = result[0]
+    algorithm = settings.HASH_ALGORITHM
+    if algorithm not in storage.HASH_ALGORITHMS:
+        return f"unknown hash-algorithm '{algorithm}'", 2274
+
+    metadata = {}
+    files = []
+
+    def store_member(path, f_in, length):
+        path = os.path.normpath(path)
+        if not _is_safe_path(path):
+            raise ValueError(f'invalid path in archive: {path}')
+        entry = _store_file(f_in, length, codec, algorithm, settings.BACKUP_CHUNKING and length >= settings.CHUNKING_MIN_FILE_SIZE)
+        entry.update({'path': path, 'size': length})
+        files.append(entry)
+
+    try:
+        if archive_format == 'tar':
+            with tarfile.open(fileobj=stream, mode='r|*') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    if member.name == ARCHIVE_MANIFEST:
+                        # only the metadata, the entries of files and chunks come from the stored members
+                        for line in archive.extractfile(member).read().decode().splitlines():
+                            key, _, value = line.partition('=')
+                            if key.strip() in ARCHIVE_METADATA and value != '':
+                                metadata[key.strip()] = value.strip()
+                    elif member.name.startswith('world/'):
+                        store_member(member.name[len('world/'):], archive.extractfile(member), member.size)
+        else:
+            temp_file = os.path.join(settings.INCREMENTAL_PATH, f'.{helpers.rnd(12)}.tmp')
+            try:
+                with open(temp_file, 'wb') as f_out:
+                    shutil.copyfileobj(stream, f_out, settings.BACKUP_CHUNK_SIZE)
+                with zipfile.ZipFile(temp_file) as archive:
+                    members = [info for info in archive.infolist() if not info.is_dir()]
+                    # some tools zip the world-folder itself instead of its content
+                    prefix = ''
+                    if not any(info.filename == 'level.dat' for info in members):
+                        prefix = next((info.filename[:-len('level.dat')] for info in members if info.filename.endswith('/level.dat')), '')
+                    for info in members:
+                        if not info.filename.startswith(prefix):
+                            continue
+                        with archive.open(info) as f_in:
+                            store_member(info.filename[len(prefix):], f_in, info.file_size)
+                        if info.filename == prefix + 'levelname.txt':
+                            metadata['level-name'] = archive.read(info).decode().strip()
+            finally:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+    except Exception as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2277
+
+    server_name = metadata.get('server-name') if helpers.is_empty(server_name) else server_name
+    if helpers.is_empty(server_name):
+        return 'server-name is required', 2275
+    level_name = metadata.get('level-name', 'Bedrock level') if helpers.is_empty(level_name) else level_name
+    if helpers.is_empty(backup_name):
+        backup_name = metadata.get('backup-name') or time.strftime('%Y%m%d_%H%M%S') + '_' + server_name + '_' + level_name
+    backup_name = backup_name[:-len('.properties')] if backup_name.endswith('.properties') else backup_name
+    if not all(_is_plain_name(name) for name in [server_name, level_name, backup_name]):
+        return 'invalid server-, level- or backup-name', 2270
+    backup_file = os.path.join(settings.BACKUPS_PATH, backup_name + '.properties')
+    if os.path.exists(backup_file) and not helpers.is_true(overwrite):
+        return 'backup with this name already exists', 2276
+
+    metadata.update({
+        'server-name': server_name,
+        'level-name': level_name,
+        'backup-name': backup_name,
+        'datetime': metadata.get('datetime', time.strftime('%Y-%m-%d %H:%M')),
+        'description': metadata.get('description', f'imported {archive_format}'),
+        'version': metadata.get('version', 'unknown'),
+        'hash-algorithm': algorithm
+    })
+
+    result = _resolve_blob_details(files)
+    if result[1] > 0:
+        return 'cannot resolve stored blobs', 2278, result
+    result = _write_manifest(backup_file, metadata, files)
+    if result[1] > 0:
+        return 'error at write backup', 2279, result
+    result = catalog.add_backup(backup_name, metadata, files, os.stat(backup_file).st_mtime_ns)
+    if result[1] > 0:
+        logging.error(f"cannot add backup to catalog: {result[0]}")
+    else:
+        storage.remove(result[0])  # blobs only used by an overwritten backup
+
+    helpers.change_permissions_recursive(settings.BACKUPS_PATH, 0o777)
+    result_properties = metadata.copy()
+    result_properties['file-count'] = len(files)
+    result_properties['size'] = sum(entry['size'] for entry in files)
+    return result_properties, 0
+
 def list():  #203x
-    result_list = {}
-    for backup_file in [file for file in os.listdir(settings.BACKUPS_PATH) if os.path.isfile(os.path.join(settings.BACKUPS_PATH, file))]:
-        result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, backup_file))
-        if result[1] > 0:
-            return 'cannot read backup-details', 2031
-        
-        properties = {'file-count': 0}
-        for key, value in result[0].items():
-            if len(key) == 128:
-                properties['file-count'] += 1
-            elif key != 'file-count':
-                properties[key] = value
-
-        backup_file = backup_file[:-len('.properties')] if backup_file.endswith('.properties') else backup_file
-        result_list[backup_file] = properties
-    return result_list, 0
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2031, result
+    result = catalog.list_backups()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2032, result
+    return result[0], 0
     
+def summary():  # 228x
+    # sizes and dedup-ratio of the whole backup-store, read from the catalog without walking the store
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2281, result
+    result = catalog.summary()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2282, result
+    return result[0], 0
+
 def remove(backup_name=None):  # 204x
     if helpers.is_empty(backup_name):
         return 'backup-name is required', 2041
@@ -183,55 +659,344 @@ def remove(backup_name=None):  # 204x
     result = _get_backup_by_name(backup_name)
     if result[1] > 0:
         return 'backup does not exists', 2042, result
+    backup_info = result[0]
 
-    # remove backup-file
-    backup_file = os.path.join(settings.BACKUPS_PATH, result[0]['backup-file'])
-    if not os.path.exists(backup_file):
+    if not os.path.exists(os.path.join(settings.BACKUPS_PATH, backup_info['backup-file'])):
         return f'backup does not exists {backup_name}', 2043
-    os.remove(backup_file)
-    
-    # list all referenced sha512-files
-    linked_files = []
-    for backup_file in [file for file in os.listdir(settings.BACKUPS_PATH) if os.path.isfile(os.path.join(settings.BACKUPS_PATH, file))]:
-        result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, backup_file))
+
+    result = _remove_backups([backup_info['backup-file']])
+    if result[1] > 0:
+        return 'cannot remove backup', 2044, result
+    return {
+        'backup-name': backup_info['backup-name'],
+        'backup-file': backup_info['backup-file'],
+        'state': 'removed'
+    }, 0
+
+def remove_batch(backup_names=None):  # 209x
+    if helpers.is_empty(backup_names):
+        return 'backup-names are required', 2091
+    if isinstance(backup_names, str):
+        backup_names = [backup_names]
+
+    states = {
+        'removed': [],
+        'not-found': []
+    }
+    backup_files = []
+    for backup_name in backup_names:
+        result = _get_backup_by_name(backup_name)
+        if result[1] > 0 or not os.path.exists(os.path.join(settings.BACKUPS_PATH, result[0]['backup-file'])):
+            states['not-found'].append(backup_name)
+        elif result[0]['backup-file'] not in backup_files:
+            backup_files.append(result[0]['backup-file'])
+            states['removed'].append(backup_name)
+
+    result = _remove_backups(backup_files)
+    if result[1] > 0:
+        return 'cannot remove backups', 2092, result
+    states['removed-blobs'] = result[0]['removed-blobs']
+    return states, 0
+
+def prune(server_names=None, policy=None, dry_run=False):  # 224x
+    # removes the backups outside of the retention-policy per server and world (grandfather-father-son).
+    # the catalog is synced once and all backup-files and unused blobs are removed in one pass
+    if isinstance(server_names, str):
+        server_names = [server_names]
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2241, result
+    result = catalog.list_backups()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2242, result
+
+    groups = {}
+    for name, properties in result[0].items():
+        if helpers.is_empty(properties.get('server-name')) or helpers.is_empty(properties.get('level-name')):
+            continue
+        if not helpers.is_empty(server_names) and properties['server-name'] not in server_names:
+            continue
+        try:
+            moment = time.strptime(properties.get('datetime') or '', '%Y-%m-%d %H:%M')
+        except ValueError:
+            continue  # backups without a readable datetime are never pruned
+        groups.setdefault((properties['server-name'], properties['level-name']), []).append((moment, name))
+
+    states = {
+        'dry-run': helpers.is_true(dry_run),
+        'kept': {},
+        'pruned': []
+    }
+    for (server_name, level_name), backups in sorted(groups.items()):
+        result = _retention_policy(server_name, policy)
         if result[1] > 0:
-            return 'cannot read backup-details', 2044
-        properties = result[0]
-        for sha512 in properties:
-            if len(sha512) == 128 and sha512 not in linked_files:
-                linked_files.append(sha512)
+            return 'invalid retention-policy', 2243, result
+        backups.sort(reverse=True)
+        kept = _retained_backups(backups, result[0])
+        states['kept'][f'{server_name}/{level_name}'] = [name for _, name in backups if name in kept]
+        states['pruned'] += [name for _, name in backups if name not in kept]
 
-    # remove all unreferenced sha512-files
-    try:
-        for sha512 in os.listdir(settings.INCREMENTAL_PATH):
-            if sha512 not in linked_files:
-                os.remove(os.path.join(settings.INCREMENTAL_PATH, sha512))
-        return {
-            'backup-name': result[0]['backup-name'],
-            'backup-file': result[0]['backup-file'],
-            'state': 'removed'
-        }, 0
-    except Exception as e:
-        logging.error(f"unexpected error: {e}")
-        return str(e), 2045
+    # the blobs only used by the pruned backups, by the same refcounts as the removal itself
+    result = catalog.remove_backups(states['pruned'], True)
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2244, result
+    orphaned = result[0]
+    result = catalog.get_blobs(orphaned)
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2245, result
+    states['reclaimed-blobs'] = len(orphaned)
+    states['reclaimed-bytes'] = sum(blob['stored-size'] or 0 for blob in result[0].values())
+    if states['dry-run'] or len(states['pruned']) == 0:
+        return states, 0
+
+    result = _remove_backups([name + '.properties' for name in states['pruned']])
+    if result[1] > 0:
+        return 'cannot remove backups', 2246, result
+    states['removed-blobs'] = result[0]['removed-blobs']
+    return states, 0
+
+def all_server(hot=False, workers=None, max_bandwidth=None):  # 205x
+    # backs up every created server, but at most workers at the same time and together below max_bandwidth, so
+    # the running servers keep their disk. servers without players go first, then the longest not backed up,
+    # then the biggest, so a short window of the job covers the servers where a backup costs nobody anything
+    start_time = time.time()
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2051, result
+    result = catalog.list_backups()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2052, result
+    newest = {}
+    for properties in result[0].values():
+        server_name = properties.get('server-name')
+        if server_name and (properties.get('datetime') or '') >= (newest.get(server_name, {}).get('datetime') or ''):
+            newest[server_name] = properties
+
+    running = server.get_running()
+    queue = []
+    for server_name in server.get_created():
+        user_count = 0
+        if server_name in running:
+            result = server.parse_log(server_name)
+            if result[1] == 0:
+                user_count = result[0].get('user-count', 0)
+        latest = newest.get(server_name, {})
+        queue.append({
+            'server-name': server_name,
+            'user-count': user_count,
+            'last-backup': latest.get('datetime'),
+            'size': latest.get('size') or 0
+        })
+    # never backed up sorts before every datetime, the datetime-format sorts like the time
+    queue.sort(key=lambda entry: (entry['user-count'] > 0, entry['last-backup'] or '', -entry['size'], entry['server-name']))
+
+    workers = settings.BACKUP_ALL_WORKERS if workers in [None, ''] else int(workers)
+    workers = max(1, workers)
+    max_bandwidth = settings.BACKUP_MAX_BANDWIDTH if max_bandwidth in [None, ''] else int(max_bandwidth)
+    limiter = helpers.create_throttle(max_bandwidth)
+    file_workers = max(1, settings.BACKUP_WORKERS // workers)  # the threads of all backups together stay at BACKUP_WORKERS
+    queued_time = time.time()
+
+    def backup_queued(entry):
+        started_time = time.time()
+        result = create(entry['server-name'], workers=file_workers, hot=hot, limiter=limiter)
+        return result, started_time - queued_time, time.time() - started_time
 
-def all_server():  # 205x
     states = {
         'backed-up': [],
         'still-running': [],
-        'failed': []
+        'failed': [],
+        'schedule': {}
     }
-    for sub_result in helpers.parallel(create, server.get_created()):
-        server_name = sub_result['parameters']
-        result = sub_result['result']
-        if result[1] == 0:
-            states['backed-up'].append(server_name)
-        elif result[1] == 2014:
-            states['still-running'].append(server_name)
-        else:
-            states['failed'].append(server_name)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # the executor starts the backups in the order of the queue
+        for position, (entry, (result, queue_wait, execution)) in enumerate(zip(queue, executor.map(backup_queued, queue))):
+            server_name = entry['server-name']
+            if result[1] == 0:
+                states['backed-up'].append(server_name)
+            elif result[1] == 2014:
+                states['still-running'].append(server_name)
+            else:
+                states['failed'].append(server_name)
+            states['schedule'][server_name] = {
+                'position': position,
+                'user-count': entry['user-count'],
+                'last-backup': entry['last-backup'],
+                'queue-wait': round(queue_wait, 3),
+                'execution': round(execution, 3)
+            }
+    states['times'] = round(time.time() - start_time, 3)
+    return states, 0
+
+def migrate_store():  # 212x
+    result = storage.migrate()
+    if result[1] > 0:
+        return 'cannot migrate backup-store', 2121, result
+    return result[0], 0
+
+def migrate_hash_algorithm():  # 222x
+    # stores the files of every backup with another hash-algorithm again under settings.HASH_ALGORITHM.
+    # a backup-file is replaced at once and stays restorable, old blobs are removed when no backup uses them anymore
+    algorithm = settings.HASH_ALGORITHM
+    if algorithm not in storage.HASH_ALGORITHMS:
+        return f"unknown hash-algorithm '{algorithm}'", 2221
+    if not _hash_migration_lock.acquire(blocking=False):
+        return 'hash-migration is already running', 2222
+    try:
+        result = _sync_catalog()
+        if result[1] > 0:
+            return 'cannot sync backup-catalog', 2223, result
+        states = {
+            'hash-algorithm': algorithm,
+            'migrated': 0,
+            'skipped': 0,
+            'failed': {}
+        }
+        # (old key, codec): result of the rekey, a blob is stored once for all backups. the rekey reads the
+        # content, so it also gives the size that backup-files of version 1 do not have
+        rekeyed = {}
+        for backup_file in sorted(os.listdir(settings.BACKUPS_PATH)):
+            if not backup_file.endswith('.properties'):
+                continue
+            backup_path = os.path.join(settings.BACKUPS_PATH, backup_file)
+            result = _read_manifest(backup_path)
+            if result[1] > 0:
+                states['failed'][backup_file] = result
+                continue
+            metadata = result[0]['metadata']
+            files = result[0]['files']
+            if all(storage.key_algorithm(entry['hash']) == algorithm for entry in files):
+                states['skipped'] += 1
+                continue
+
+            result = _resolve_blob_details(files)
+            if result[1] > 0:
+                states['failed'][backup_file] = result
+                continue
+            try:
+                for entry in files:
+                    if storage.key_algorithm(entry['hash']) == algorithm:
+                        continue
+                    old_key = (entry['hash'], entry['codec'])
+                    if entry['codec'] == CHUNKED:
+                        if old_key not in rekeyed:
+                            rekeyed[old_key] = storage.rekey_chunks(_content_of(entry), algorithm)
+                        entry['hash'], chunks, entry['size'] = rekeyed[old_key]
+                        entry['stored-size'] = None
+                        entry['chunks'] = [{'hash': chunk_hash, 'codec': codec_name, 'stored-size': stored_size} for chunk_hash, codec_name, stored_size in chunks]
+                    else:
+                        if old_key not in rekeyed:
+                            rekeyed[old_key] = storage.rekey(entry['hash'], entry['codec'], algorithm)
+                        entry['hash'], entry['codec'], entry['stored-size'], entry['size'] = rekeyed[old_key]
+            except Exception as e:
+                logging.error(f"unexpected error: {e}")
+                states['failed'][backup_file] = str(e), 2224
+                continue
+            result = _resolve_blob_details(files)  # blobs which existed already under the new key
+            if result[1] > 0:
+                states['failed'][backup_file] = result
+                continue
+
+            metadata['hash-algorithm'] = algorithm
+            result = _write_manifest(backup_path, metadata, files)
+            if result[1] > 0:
+                states['failed'][backup_file] = result
+                continue
+            name = backup_file[:-len('.properties')]
+            result = catalog.add_backup(name, metadata, files, os.stat(backup_path).st_mtime_ns)
+            if result[1] == 0:
+                storage.remove(result[0])
+            states['migrated'] += 1
+        return states, 0
+    finally:
+        _hash_migration_lock.release()
+
+def start_hash_migration():  # 223x
+    if _hash_migration_lock.locked():
+        return {
+            'state': 'already running'
+        }, 0
+    thread = threading.Thread(target=migrate_hash_algorithm, name='hash-migration', daemon=True)
+    thread.start()
+    return {
+        'state': 'started'
+    }, 0
+
+def rebuild_catalog():  # 206x
+    result = catalog.clear()
+    if result[1] > 0:
+        return 'cannot clear backup-catalog', 2061, result
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot rebuild backup-catalog', 2062, result
+    states = result[0]
+
+    # blobs of failed or crashed creates and imports are referenced by no backup-file. the blobs of broken
+    # backup-files are not in the catalog, so nothing is swept while there are some
+    if len(states['invalid']) == 0:
+        result = catalog.list_blobs()
+        if result[1] > 0:
+            return 'cannot read backup-catalog', 2063, result
+        result = storage.sweep({file_hash for file_hash, _ in result[0]}, settings.SWEEP_MIN_AGE)
+        if result[1] > 0:
+            return 'cannot sweep backup-store', 2064, result
+        states['swept'] = result[0]
     return states, 0
 
+def _remove_backups(backup_files):  # 210x
+    # removes the backup-files and afterwards only the blobs whose refcount dropped to zero. the catalog has to
+    # know all backups before, a blob of a backup missing in it would be released too early
+    result = _sync_catalog()
+    if result[1] > 0:
+        return 'cannot sync backup-catalog', 2103, result
+    for backup_file in backup_files:
+        try:
+            os.remove(os.path.join(settings.BACKUPS_PATH, backup_file))
+        except FileNotFoundError:
+            pass
+    result = catalog.remove_backups([backup_file[:-len('.properties')] for backup_file in backup_files])
+    if result[1] > 0:
+        return 'cannot remove backups from catalog', 2101, result
+    result = storage.remove(result[0])
+    if result[1] > 0:
+        return 'cannot remove unreferenced blobs', 2102, result
+    return {
+        'removed-blobs': result[0]
+    }, 0
+
+def _retention_policy(server_name, policy):  # 225x
+    # settings.RETENTION_POLICY, overridden by the settings of the server and by the given policy
+    merged = dict(settings.RETENTION_POLICY)
+    merged.update(settings.RETENTION_POLICIES.get(server_name, {}))
+    merged.update({key: value for key, value in (policy or {}).items() if value not in [None, '']})
+    for key, value in merged.items():
+        if key != 'last' and key not in RETENTION_PERIODS:
+            return f"unknown retention-period '{key}', available: last, {', '.join(RETENTION_PERIODS)}", 2251
+        try:
+            merged[key] = int(value)
+        except (TypeError, ValueError):
+            return f"invalid count '{value}' for '{key}'", 2252
+        if merged[key] < 0:
+            return f"invalid count '{value}' for '{key}'", 2252
+    if sum(merged.values()) == 0:
+        return 'the retention-policy keeps no backup', 2253
+    return merged, 0
+
+def _retained_backups(backups, policy):
+    # backups: [(time.struct_time, name)], the newest first. every period keeps the newest backup of its newest periods
+    kept = {name for _, name in backups[:policy.get('last', 0)]}
+    for period, time_format in RETENTION_PERIODS.items():
+        periods = set()
+        for moment, name in backups:
+            key = time.strftime(time_format, moment)
+            if key in periods:
+                continue
+            if len(periods) >= policy.get(period, 0):
+                break
+            periods.add(key)
+            kept.add(name)
+    return kept
+
 def _get_backup_by_name(backup_name):  # 207x
     backup_name = backup_name[:-len('.properties')] if backup_name.endswith('.properties') else backup_name
     backup_file = backup_name + '.properties'
@@ -242,15 +1007,281 @@ def _get_backup_by_name(backup_name):  # 207x
             'backup-file': backup_file
         }, 0
 
-    result = list()
+    result = _sync_catalog()
     if result[1] > 0:
         return 'cannot find backup', 2071, result
 
-    for file, properties in result[0].items():
-        if file == backup_name or file == backup_file or properties['backup-name'] == backup_name or properties['backup-name'] == backup_file:
-            return {
-                'backup-name': properties['backup-name'],
-                'backup-file': file
-            }, 0
+    result = catalog.find_backup(backup_name)
+    if result[1] > 0:
+        return 'cannot found backup', 2072, result
+    return result[0], 0
+
+def _sync_catalog():  # 208x
+    # only backup-files that are new or were changed since the last sync get parsed
+    result = catalog.get_manifest_states()
+    if result[1] > 0:
+        return 'cannot read backup-catalog', 2081, result
+    known = result[0]
+
+    found = {}
+    for backup_file in os.listdir(settings.BACKUPS_PATH):
+        if backup_file.endswith('.properties') and os.path.isfile(os.path.join(settings.BACKUPS_PATH, backup_file)):
+            found[backup_file[:-len('.properties')]] = os.stat(os.path.join(settings.BACKUPS_PATH, backup_file)).st_mtime_ns
+
+    added = 0
+    invalid = {}
+    for name, mtime_ns in found.items():
+        if known.get(name) == mtime_ns:
+            continue
+        result = _read_manifest(os.path.join(settings.BACKUPS_PATH, name + '.properties'))
+        if result[1] > 0:
+            # one broken backup-file does not stop the others. it keeps its entry of the catalog and so its blobs
+            logging.error(f"cannot read backup-file '{name}': {result}")
+            invalid[name] = result
+            continue
+        result = catalog.add_backup(name, result[0]['metadata'], result[0]['files'], mtime_ns)
+        if result[1] > 0:
+            return 'cannot update backup-catalog', 2083, result
+        storage.remove(result[0])
+        added += 1
+
+    # backup-files deleted by hand release their blobs as well
+    removed = [name for name in known if name not in found]
+    if len(removed) > 0:
+        result = catalog.remove_backups(removed)
+        if result[1] > 0:
+            return 'cannot update backup-catalog', 2084, result
+        storage.remove(result[0])
+
+    return {
+        'backup-count': len(found),
+        'updated': added,
+        'removed': len(removed),
+        'invalid': invalid
+    }, 0
+
+def _read_manifest(backup_file):  # 213x
+    # version 4: like version 3, a file with codec 'chunked' is followed by chunks.<n>=<key>:<codec>:<stored-size>,...
+    # version 3: file.<n>=<key>|<codec>|<size>|<stored-size>|<path>, the key is storage.make_key() of hash-algorithm.
+    # the versions before were keyed by the sha512 itself, so files with the same content got lost:
+    # version 2: <sha512>=<codec>|<size>|<stored-size>|<path>, version 1 (no manifest-version): <sha512>=<path>
+    result = helpers.read_properties(backup_file)
+    if result[1] > 0:
+        return 'cannot read backup-file', 2131, result
+    metadata = {}
+    files = []
+    chunks = {}
+    try:
+        version = int(result[0].get('manifest-version', 1))
+        for key, value in result[0].items():
+            if version >= 3 and key.startswith('file.'):
+                file_hash, codec, size, stored_size, path = value.split('|', 4)
+                files.append({'hash': file_hash, 'path': path, 'codec': codec, 'size': int(size), 'stored-size': int(stored_size)})
+                if codec == CHUNKED:
+                    files[-1]['chunks'] = chunks.setdefault(key[len('file.'):], [])
+            elif version >= 4 and key.startswith('chunks.'):
+                chunks.setdefault(key[len('chunks.'):], []).extend(
+                    {'hash': chunk_hash, 'codec': codec, 'stored-size': int(stored_size)}
+                    for chunk_hash, codec, stored_size in (chunk.split(':') for chunk in value.split(',') if chunk != '')
+                )
+            elif version < 3 and len(key) == 128 and all(char in string.hexdigits for char in key):
+                if version == 2:
+                    codec, size, stored_size, path = value.split('|', 3)
+                    files.append({'hash': key, 'path': path, 'codec': codec, 'size': int(size), 'stored-size': int(stored_size)})
+                else:
+                    files.append({'hash': key, 'path': value, 'codec': None, 'size': None, 'stored-size': None})
+            elif key not in ['file-count', 'manifest-version']:
+                metadata[key] = value
+    except ValueError as e:
+        logging.error(f"invalid backup-file '{backup_file}': {e}")
+        return f'invalid backup-file: {e}', 2133
+    for entry in files:
+        if not _is_safe_path(entry['path']):
+            return f"invalid path in backup-file: {entry['path']}", 2132
+    metadata.setdefault('hash-algorithm', 'sha512')
+    return {
+        'manifest-version': version,
+        'metadata': metadata,
+        'files': files
+    }, 0
+
+def _is_safe_path(path):
+    # a path of a backup-file stays within the world
+    return path != '' and not os.path.isabs(path) and '..' not in path.replace('\\', '/').split('/')
+
+def _is_plain_name(name):
+    # a server-, level- or backup-name is one directory or file, in its parent
+    return isinstance(name, str) and name not in ['', '.', '..'] and '/' not in name and '\\' not in name
+
+def _write_manifest(backup_file, metadata, files):  # 214x
+    # replaced at once, a restore or sync never reads a half written backup-file
+    properties = dict(metadata)
+    properties['manifest-version'] = MANIFEST_VERSION
+    for i, entry in enumerate(files):
+        properties[f'file.{i}'] = f"{entry['hash']}|{entry['codec']}|{entry['size']}|{entry['stored-size']}|{entry['path']}"
+        if entry['codec'] == CHUNKED:
+            properties[f'chunks.{i}'] = ','.join(f"{chunk['hash']}:{chunk['codec']}:{chunk['stored-size']}" for chunk in entry['chunks'])
+    temp_file = f'{backup_file}.{helpers.rnd(6)}.tmp'
+    result = helpers.write_properties(temp_file, properties)
+    if result[1] > 0:
+        return 'cannot write backup-file', 2141, result
+    os.replace(temp_file, backup_file)
+    return backup_file, 0
+
+def _resolve_blob_details(files):  # 215x
+    # fills codec and stored-size of blobs that were not written right now: from the catalog,
+    # or by probing the blob for blobs stored before the codec was recorded
+    unknown = [blob for entry in files for blob in _blobs_of(entry) if blob['codec'] is None or blob['stored-size'] is None]
+    if len(unknown) > 0:
+        result = catalog.get_blobs({blob['hash'] for blob in unknown})
+        if result[1] > 0:
+            return 'cannot read backup-catalog', 2151, result
+        blobs = result[0]
+        try:
+            for blob in unknown:
+                if blob['hash'] not in blobs or blobs[blob['hash']]['codec'] is None:
+                    blobs[blob['hash']] = {
+                        'codec': storage.detect_codec(blob['hash']),
+                        'stored-size': storage.stored_size(blob['hash'])
+                    }
+                blob['codec'] = blobs[blob['hash']]['codec']
+                blob['stored-size'] = blobs[blob['hash']]['stored-size']
+        except Exception as e:
+            logging.error(f"unexpected error: {e}")
+            return str(e), 2152
+    for entry in files:
+        if entry['codec'] == CHUNKED:
+            entry['stored-size'] = sum(chunk['stored-size'] for chunk in entry['chunks'])
+    return files, 0
+
+def _store_file(input_file, length, codec, algorithm, chunked, limiter=None):
+    # stores a file or file-object of length bytes, returns a manifest-entry without path and size
+    if chunked:
+        file_hash, chunks = storage.store_chunked(input_file, codec, length, algorithm, limiter)
+        return {
+            'hash': file_hash,
+            'codec': CHUNKED,
+            'stored-size': None,
+            'chunks': [{'hash': chunk_hash, 'codec': codec_name, 'stored-size': stored_size} for chunk_hash, codec_name, stored_size in chunks]
+        }
+    file_hash, codec_name, stored_size = storage.store(input_file, codec, length, algorithm, limiter)
+    return {'hash': file_hash, 'codec': codec_name, 'stored-size': stored_size}
+
+def _content_of(entry):
+    # [(key, codec)] of the blobs, whose content is the content of the file
+    return [(blob['hash'], blob['codec']) for blob in _blobs_of(entry)]
+
+def _blobs_of(entry):
+    # the blobs holding the content of a file: its chunks, or the file is a blob itself
+    return entry['chunks'] if entry['codec'] == CHUNKED else [entry]
+
+def _export_tar(metadata, files):
+    # backup.properties and world/<path> of every file in the pax-format, the headers are built by tarfile
+    moment = _metadata_time(metadata)
+    properties = ''.join(f'{key}={value}\n' for key, value in metadata.items() if key != 'hash-algorithm').encode()
+    yield _tar_header(ARCHIVE_MANIFEST, len(properties), moment) + properties + bytes(-len(properties) % tarfile.BLOCKSIZE)
+    for entry in files:
+        yield _tar_header(f"world/{entry['path']}", entry['size'], moment)
+        size = 0
+        for data in storage.iter_content(_content_of(entry)):
+            size += len(data)
+            yield data
+        if size != entry['size']:
+            # the header is sent already, the client gets a broken archive
+            logging.error(f"cannot export {entry['path']}: {size} bytes instead of {entry['size']}")
+            raise ValueError(f"size of {entry['path']} differs from the backup-file")
+        yield bytes(-size % tarfile.BLOCKSIZE)
+    yield bytes(2 * tarfile.BLOCKSIZE)
+
+def _tar_header(name, size, moment):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = moment
+    info.mode = 0o644
+    return info.tobuf(tarfile.PAX_FORMAT)
+
+def _export_mcworld(metadata, files):
+    # a .mcworld is a zip of the content of the world-folder. zipfile writes to an unseekable output with
+    # data-descriptors, so every block is compressed and sent right after it was read
+    output = []
+
+    def write(data):
+        output.append(bytes(data))
+        return len(data)
+
+    date_time = time.localtime(_metadata_time(metadata))[:6]
+    with zipfile.ZipFile(types.SimpleNamespace(write=write, flush=lambda: None), 'w', zipfile.ZIP_DEFLATED) as archive:
+        for entry in files:
+            info = zipfile.ZipInfo(entry['path'], date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = entry['size']  # decides on zip64 for big files
+            with archive.open(info, 'w') as f_out:
+                for data in storage.iter_content(_content_of(entry)):
+                    f_out.write(data)
+                    if len(output) > 0:
+                        yield b''.join(output)
+                        output.clear()
+            if len(output) > 0:
+                yield b''.join(output)
+                output.clear()
+    yield b''.join(output)
+
+def _metadata_time(metadata):
+    try:
+        return int(time.mktime(time.strptime(metadata.get('datetime') or '', '%Y-%m-%d %H:%M')))
+    except ValueError:
+        return int(time.time())
+
+def _hold_world(server_name, level_name):  # 216x
+    # returns {path relative to the world: bytes to copy} of the running world
+    result = server.hold_save(server_name)
+    if result[1] > 0:
+        server.resume_save(server_name)
+        return 'cannot hold save', 2162, result
+    prefix = level_name + '/'
+    lengths = {}
+    for path, length in result[0].items():
+        if not path.startswith(prefix):
+            server.resume_save(server_name)
+            return f"file of another world: '{path}'", 2163
+        lengths[os.path.normpath(path[len(prefix):])] = length
+    return lengths, 0
+
+def _hash_cache_file(server_name, level_name):
+    return os.path.join(settings.HASH_CACHE_PATH, f'{server_name}.{level_name}.json'.replace(os.sep, '_'))
+
+def _read_hash_cache(server_name, level_name):
+    # {relative-path: [size, mtime_ns, inode, key(, [[chunk-key, codec]])]}, an unreadable cache is simply ignored
+    cache_file = _hash_cache_file(server_name, level_name)
+    if not os.path.exists(cache_file):
+        return {}
+    result = helpers.read_json(cache_file)
+    if result[1] > 0 or not isinstance(result[0], dict) or result[0].get('version') != HASH_CACHE_VERSION:
+        return {}
+    return result[0].get('files', {})
+
+def _hash_cache_entry(stat_key, entry):
+    # a chunked file keeps its chunks in the cache, so an unchanged file is not split again
+    if entry['codec'] == CHUNKED:
+        return stat_key + [entry['hash'], [[chunk['hash'], chunk['codec']] for chunk in entry['chunks']]]
+    return stat_key + [entry['hash']]
+
+def _cached_entry(cached):
+    # codec and stored-size are resolved by _resolve_blob_details()
+    if len(cached) > 4:
+        return {'hash': cached[3], 'codec': CHUNKED, 'stored-size': None, 'chunks': [
+            {'hash': chunk_hash, 'codec': codec, 'stored-size': None} for chunk_hash, codec in cached[4]
+        ]}
+    return {'hash': cached[3], 'codec': None, 'stored-size': None}
+
+def _write_hash_cache(server_name, level_name, files):
+    os.makedirs(settings.HASH_CACHE_PATH, exist_ok=True)
+    return helpers.write_json_atomic(_hash_cache_file(server_name, level_name), {'version': HASH_CACHE_VERSION, 'files': files})
 
-    return 'cannot found backup', 2072
+def _is_cacheable(input_file, stat_key):
+    # a file changed while hashing, or modified within the timestamp-granularity, could change
+    # again without a new mtime. those files are hashed again on the next backup.
+    stat = os.stat(input_file)
+    if [stat.st_size, stat.st_mtime_ns, stat.st_ino] != stat_key:
+        return False
+    return time.time_ns() - stat.st_mtime_ns > HASH_CACHE_RACY_NS
@@ -0,0 +1,332 @@
+# catalog.py
+# err:24xx-25xx
+
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+
+import settings
+
+CATALOG_FILE = 'catalog.sqlite'
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS backups (
+    backup_file TEXT PRIMARY KEY,
+    backup_name TEXT NOT NULL,
+    server_name TEXT,
+    level_name TEXT,
+    datetime TEXT,
+    properties TEXT NOT NULL,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime_ns INTEGER NOT NULL DEFAULT 0,
+    stored_size INTEGER NOT NULL DEFAULT 0,
+    unique_size INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS backups_backup_name ON backups(backup_name);
+CREATE TABLE IF NOT EXISTS files (
+    backup_file TEXT NOT NULL REFERENCES backups(backup_file) ON DELETE CASCADE,
+    hash TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    PRIMARY KEY (backup_file, path)
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files(hash);
+CREATE TABLE IF NOT EXISTS chunks (
+    backup_file TEXT NOT NULL REFERENCES backups(backup_file) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (backup_file, path, position)
+);
+CREATE INDEX IF NOT EXISTS chunks_hash ON chunks(hash);
+CREATE TABLE IF NOT EXISTS refs (
+    backup_file TEXT NOT NULL REFERENCES backups(backup_file) ON DELETE CASCADE,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (backup_file, hash)
+);
+CREATE INDEX IF NOT EXISTS refs_hash ON refs(hash);
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    codec TEXT,
+    stored_size INTEGER
+);
+'''
+SCHEMA_VERSION = 1  # a catalog of another version is dropped and filled again from the backup-files
+
+def add_backup(backup_file, properties, files, mtime_ns=0):  # 251x
+    # files: [{'hash', 'path', 'size', 'codec', 'stored-size'}], unknown values are None.
+    # a chunked file has 'chunks': [{'hash', 'codec', 'stored-size'}], its own hash is no blob.
+    # an existing entry with the same backup-file is replaced. the stored and unique bytes of the backups
+    # are kept up to date with every blob whose refcount crosses between 1 and 2.
+    # returns the hashes which are no longer referenced by any backup
+    try:
+        with _transaction() as connection:
+            orphaned = _delete_backups(connection, [backup_file])
+            connection.execute(
+                'INSERT INTO backups (backup_file, backup_name, server_name, level_name, datetime, properties, file_count, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    backup_file,
+                    properties.get('backup-name', backup_file),
+                    properties.get('server-name'),
+                    properties.get('level-name'),
+                    properties.get('datetime'),
+                    json.dumps(properties),
+                    len(files),
+                    sum(entry.get('size') or 0 for entry in files),
+                    mtime_ns
+                )
+            )
+            connection.executemany(
+                'INSERT OR REPLACE INTO files (backup_file, hash, path, size) VALUES (?, ?, ?, ?)',
+                [(backup_file, entry['hash'], entry['path'], entry.get('size')) for entry in files]
+            )
+            connection.executemany(
+                'INSERT INTO chunks (backup_file, path, position, hash) VALUES (?, ?, ?, ?)',
+                [(backup_file, entry['path'], position, chunk['hash']) for entry in files for position, chunk in enumerate(entry.get('chunks') or [])]
+            )
+            blobs = {}
+            for entry in files:
+                for blob in entry['chunks'] if entry.get('chunks') is not None else [entry]:
+                    blobs[blob['hash']] = blob
+            connection.executemany('INSERT OR IGNORE INTO blobs (hash) VALUES (?)', [(file_hash,) for file_hash in blobs])
+            connection.executemany(
+                'UPDATE blobs SET refcount = refcount + 1, codec = COALESCE(?, codec), stored_size = COALESCE(?, stored_size) WHERE hash = ?',
+                [(entry.get('codec'), entry.get('stored-size'), file_hash) for file_hash, entry in blobs.items()]
+            )
+            stored_size = 0
+            unique_size = 0
+            for file_hash in blobs:
+                row = connection.execute('SELECT refcount, COALESCE(stored_size, 0) AS stored_size FROM blobs WHERE hash = ?', (file_hash,)).fetchone()
+                stored_size += row['stored_size']
+                if row['refcount'] == 1:
+                    unique_size += row['stored_size']
+                elif row['refcount'] == 2:
+                    _add_unique_size(connection, file_hash, -row['stored_size'])  # no longer unique to the other backup
+            # added last, so _add_unique_size() finds the other backup of a blob shared just now
+            connection.executemany('INSERT INTO refs (backup_file, hash) VALUES (?, ?)', [(backup_file, file_hash) for file_hash in blobs])
+            connection.execute(
+                'UPDATE backups SET stored_size = ?, unique_size = ? WHERE backup_file = ?', (stored_size, unique_size, backup_file)
+            )
+            orphaned.difference_update(blobs)
+        return orphaned, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2511
+
+def remove_backups(backup_files, dry_run=False):  # 252x
+    # returns the hashes which are no longer referenced by any backup. a dry-run changes nothing
+    try:
+        with _transaction() as connection:
+            orphaned = _delete_backups(connection, backup_files)
+            if dry_run:
+                connection.rollback()
+        return orphaned, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2521
+
+def list_backups():  # 253x
+    try:
+        with _transaction() as connection:
+            rows = connection.execute(
+                'SELECT backup_file, properties, file_count, size, stored_size, unique_size FROM backups ORDER BY backup_file'
+            ).fetchall()
+        result_list = {}
+        for row in rows:
+            properties = json.loads(row['properties'])
+            properties['file-count'] = row['file_count']
+            properties['size'] = row['size']
+            properties['stored-size'] = row['stored_size']
+            properties['unique-size'] = row['unique_size']
+            result_list[row['backup_file']] = properties
+        return result_list, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2531
+
+def latest_backups():  # 258x
+    # the newest backup of every server and level
+    try:
+        with _transaction() as connection:
+            rows = connection.execute(
+                'SELECT backup_file, backup_name, server_name, level_name, datetime FROM ('
+                '    SELECT *, ROW_NUMBER() OVER (PARTITION BY server_name, level_name ORDER BY datetime DESC, mtime_ns DESC, backup_file DESC) AS position FROM backups'
+                ') WHERE position = 1 AND server_name IS NOT NULL AND level_name IS NOT NULL ORDER BY server_name, level_name'
+            ).fetchall()
+        return [{
+            'backup-file': row['backup_file'] + '.properties',
+            'backup-name': row['backup_name'],
+            'server-name': row['server_name'],
+            'level-name': row['level_name'],
+            'datetime': row['datetime']
+        } for row in rows], 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2581
+
+def summary():  # 249x
+    # store-wide figures, all from the counters of the catalog
+    try:
+        with _transaction() as connection:
+            backups = connection.execute(
+                'SELECT COUNT(*) AS backup_count, COALESCE(SUM(file_count), 0) AS file_count, COALESCE(SUM(size), 0) AS size, '
+                'COALESCE(SUM(unique_size), 0) AS unique_size FROM backups'
+            ).fetchone()
+            blobs = connection.execute(
+                'SELECT COUNT(*) AS blob_count, COALESCE(SUM(stored_size), 0) AS stored_size FROM blobs WHERE refcount > 0'
+            ).fetchone()
+        return {
+            'backup-count': backups['backup_count'],
+            'file-count': backups['file_count'],
+            'blob-count': blobs['blob_count'],
+            'size': backups['size'],
+            'stored-size': blobs['stored_size'],
+            'unique-size': backups['unique_size'],
+            'shared-size': blobs['stored_size'] - backups['unique_size'],
+            'dedup-ratio': round(backups['size'] / blobs['stored_size'], 2) if blobs['stored_size'] > 0 else None
+        }, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2491
+
+def find_backup(backup_name):  # 254x
+    try:
+        with _transaction() as connection:
+            row = connection.execute(
+                'SELECT backup_file, backup_name FROM backups WHERE backup_file = ? OR backup_name = ? ORDER BY backup_file LIMIT 1',
+                (backup_name, backup_name)
+            ).fetchone()
+        if row is None:
+            return 'cannot found backup', 2541
+        return {
+            'backup-name': row['backup_name'],
+            'backup-file': row['backup_file'] + '.properties'
+        }, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2542
+
+def get_manifest_states():  # 255x
+    try:
+        with _transaction() as connection:
+            rows = connection.execute('SELECT backup_file, mtime_ns FROM backups').fetchall()
+        return {row['backup_file']: row['mtime_ns'] for row in rows}, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2551
+
+def get_blobs(hashes):  # 256x
+    # returns {hash: {'codec', 'stored-size'}} for the known hashes
+    try:
+        hashes = [file_hash for file_hash in hashes]
+        blobs = {}
+        with _transaction() as connection:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = connection.execute(
+                    f'SELECT hash, codec, stored_size FROM blobs WHERE hash IN ({",".join("?" * len(part))})', part
+                ).fetchall()
+                for row in rows:
+                    blobs[row['hash']] = {'codec': row['codec'], 'stored-size': row['stored_size']}
+        return blobs, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2561
+
+def list_blobs():  # 259x
+    # [(hash, codec)] of all referenced blobs, ordered by hash
+    try:
+        with _transaction() as connection:
+            rows = connection.execute('SELECT hash, codec FROM blobs WHERE refcount > 0 ORDER BY hash').fetchall()
+        return [(row['hash'], row['codec']) for row in rows], 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2591
+
+def find_files(hashes):  # 250x
+    # {hash: [(backup-file, path)]} of the backups using the given hashes
+    try:
+        hashes = [file_hash for file_hash in hashes]
+        files = {}
+        with _transaction() as connection:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = connection.execute(
+                    f'SELECT backup_file, hash, path FROM files WHERE hash IN ({",".join("?" * len(part))}) ORDER BY backup_file, path', part
+                ).fetchall()
+                rows += connection.execute(
+                    f'SELECT DISTINCT backup_file, hash, path FROM chunks WHERE hash IN ({",".join("?" * len(part))}) ORDER BY backup_file, path', part
+                ).fetchall()
+                for row in rows:
+                    files.setdefault(row['hash'], []).append((row['backup_file'], row['path']))
+        return files, 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2501
+
+def clear():  # 257x
+    try:
+        with _transaction() as connection:
+            connection.execute('DELETE FROM refs')
+            connection.execute('DELETE FROM chunks')
+            connection.execute('DELETE FROM files')
+            connection.execute('DELETE FROM backups')
+            connection.execute('DELETE FROM blobs')
+        return 'cleared', 0
+    except sqlite3.Error as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2571
+
+@contextlib.contextmanager
+def _transaction():
+    # every call gets its own connection, so the catalog can be used from threads and processes
+    connection = sqlite3.connect(os.path.join(settings.BACKUPS_PATH, CATALOG_FILE), timeout=60)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA foreign_keys=ON')
+        if connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            _reset(connection)
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def _reset(connection):
+    # the catalog is derived from the backup-files, the next sync adds all of them again
+    connection.executescript(
+        'BEGIN IMMEDIATE; DROP TABLE IF EXISTS refs; DROP TABLE IF EXISTS chunks; DROP TABLE IF EXISTS files; '
+        'DROP TABLE IF EXISTS blobs; DROP TABLE IF EXISTS backups;' + SCHEMA + f'PRAGMA user_version = {SCHEMA_VERSION}; COMMIT;'
+    )
+
+def _delete_backups(connection, backup_files):
+    # decrements the refcount of every blob of the given backups once and drops the blobs that reached zero.
+    # a blob left with one reference becomes unique to that backup
+    hashes = set()
+    for backup_file in backup_files:
+        rows = connection.execute('SELECT hash FROM refs WHERE backup_file = ?', (backup_file,)).fetchall()
+        connection.executemany('UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?', [(row['hash'],) for row in rows])
+        connection.execute('DELETE FROM backups WHERE backup_file = ?', (backup_file,))
+        for row in rows:
+            blob = connection.execute('SELECT refcount, COALESCE(stored_size, 0) AS stored_size FROM blobs WHERE hash = ?', (row['hash'],)).fetchone()
+            if blob is not None and blob['refcount'] == 1:
+                _add_unique_size(connection, row['hash'], blob['stored_size'])
+        hashes.update(row['hash'] for row in rows)
+    orphaned = set()
+    for file_hash in hashes:
+        row = connection.execute('SELECT refcount FROM blobs WHERE hash = ?', (file_hash,)).fetchone()
+        if row is None or row['refcount'] <= 0:
+            orphaned.add(file_hash)
+    connection.executemany('DELETE FROM blobs WHERE hash = ?', [(file_hash,) for file_hash in orphaned])
+    return orphaned
+
+def _add_unique_size(connection, file_hash, size):
+    # to the backup that references the blob as the only one
+    connection.execute(
+        'UPDATE backups SET unique_size = unique_size + ? WHERE backup_file = (SELECT backup_file FROM refs WHERE hash = ? LIMIT 1)',
+        (size, file_hash)
+    )
@@ -0,0 +1,57 @@
+# chunking.py
+
+import hashlib
+
+# gear-table of the rolling hash. it must never change, otherwise no chunk of older backups is found again
+GEAR = [int.from_bytes(hashlib.sha256(i.to_bytes(2, 'big')).digest()[:8], 'big') for i in range(256)]
+WINDOW = 4
+# the bit of a position mixes one gear-bit of each of the last WINDOW bytes. translate, big-int xor and
+# bytes.find scan at c-speed, a per-byte loop in python would be thirty times slower
+GEAR_BITS = [bytes((gear >> (63 - i)) & 1 for gear in GEAR) for i in range(WINDOW)]
+
+def split(f_in, length, min_size, avg_size, max_size):
+    # yields the first length bytes of f_in in content-defined chunks: a cut is made behind the first run of
+    # set gear-bits that is long enough, so an insert or removal only changes the chunks around it
+    bits = avg_size.bit_length() - 1
+    anchor_small = b'\x01' * bits  # before the average size a cut is harder
+    anchor_large = b'\x01' * (bits - 2)  # behind it easier, so the sizes stay close to the average
+    buffer = bytearray()
+    gear_bits = bytearray()
+    tail = b''  # the last bytes before the buffer, they belong to the window of its first positions
+    remaining = length
+    while True:
+        while len(buffer) < max_size and remaining > 0:
+            data = f_in.read(min(remaining, max_size * 4))
+            if not data:
+                remaining = 0
+                break
+            gear_bits += _gear_bits(tail + data)[len(tail):]
+            tail = data[-(WINDOW - 1):]
+            buffer += data
+            remaining -= len(data)
+        if len(buffer) == 0:
+            return
+        cut = _find_cut(gear_bits, min_size, avg_size, max_size, anchor_small, anchor_large)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+        del gear_bits[:cut]
+
+def _find_cut(gear_bits, min_size, avg_size, max_size, anchor_small, anchor_large):
+    end = min(len(gear_bits), max_size)
+    if end <= min_size:
+        return end
+    normal = min(avg_size, end)
+    position = gear_bits.find(anchor_small, min_size, normal)
+    if position >= 0:
+        return position + len(anchor_small)
+    position = gear_bits.find(anchor_large, max(normal - len(anchor_large) + 1, min_size), end)
+    if position >= 0:
+        return position + len(anchor_large)
+    return end
+
+def _gear_bits(data):
+    # one byte (0 or 1) per position of data
+    mixed = 0
+    for i, table in enumerate(GEAR_BITS):
+        mixed ^= int.from_bytes(data[:len(data) - i].translate(table), 'big')  # shifted by i positions
+    return mixed.to_bytes(len(data), 'big')
@@ -3,6 +3,7 @@
 
 import click
 import json
+import os
 import sys
 
 import backup
@@ -122,10 +123,13 @@ def get_worlds(server_name):  # 1060
 @click.option('--backup_name', '-b', help='Name for this backup')
 @click.option('--overwrite', '-o', is_flag=True, help='Will overwrite exists backup-file')
 @click.option('--description', '-d', help='Description for the backup')
-@click.option('--compress', '-c', is_flag=True, help='Will compress the backup-files')
-def create_backup(server_name, level_name, backup_name, overwrite, description, compress):  # 1061
+@click.option('--compress', '-c', is_flag=False, flag_value='gzip', default=None, help='Codec for the backup-files: none, gzip, lzma, zstd, lz4 or auto, optional with level like gzip:6. -c alone means gzip')
+@click.option('--workers', '-w', type=int, help='Number of threads hashing and compressing files')
+@click.option('--hot', is_flag=True, help='Backup a running world with save hold/query/resume')
+@click.option('--chunked/--not-chunked', default=None, help='Store big files as content-defined chunks, default by the settings')
+def create_backup(server_name, level_name, backup_name, overwrite, description, compress, workers, hot, chunked):  # 1061
     try:
-        _get_output(backup.create(server_name, level_name, backup_name, overwrite, description, compress))
+        _get_output(backup.create(server_name, level_name, backup_name, overwrite, description, compress, workers, hot, chunked))
     except Exception as e:
         _get_output([str(e), 1061])
     
@@ -136,6 +140,13 @@ def get_backup_list():  # 1062
     except Exception as e:
         _get_output([str(e), 1062])
 
+@cli.command()
+def get_backup_summary():  # 1083
+    try:
+        _get_output(backup.summary())
+    except Exception as e:
+        _get_output([str(e), 1083])
+
 @cli.command()
 @click.option('--backup-name', '-b', prompt=True, help='Name of the backup')
 @click.option('--server-name', '-n', prompt=True, help='Name of the server')
@@ -194,9 +205,12 @@ def get_server_details(server_name):  # 1069
         _get_output([str(e), 1069])
 
 @cli.command()
-def backup_all_server():  # 1070
+@click.option('--hot', is_flag=True, help='Backup running worlds with save hold/query/resume')
+@click.option('--workers', '-w', type=int, help='Number of servers backed up at the same time')
+@click.option('--max-bandwidth', '-m', type=int, help='Bytes per second for all backups together, 0 is unlimited')
+def backup_all_server(hot, workers, max_bandwidth):  # 1070
     try:
-        _get_output(backup.all_server())
+        _get_output(backup.all_server(hot, workers, max_bandwidth))
     except Exception as e:
         _get_output([str(e), 1070])
 
@@ -218,6 +232,111 @@ def update_all_server(force):  # 1072
     except Exception as e:
         _get_output([str(e), 1072])
 
+@cli.command()
+def rebuild_backup_catalog():  # 1073
+    try:
+        _get_output(backup.rebuild_catalog())
+    except Exception as e:
+        _get_output([str(e), 1073])
+
+@cli.command()
+@click.option('--backup-name', '-b', multiple=True, required=True, help='Name of a backup, can be given multiple times')
+def remove_backups(backup_name):  # 1074
+    try:
+        _get_output(backup.remove_batch(list(backup_name)))
+    except Exception as e:
+        _get_output([str(e), 1074])
+
+@cli.command()
+def migrate_backup_store():  # 1075
+    try:
+        _get_output(backup.migrate_store())
+    except Exception as e:
+        _get_output([str(e), 1075])
+
+@cli.command()
+@click.option('--server-name', '-n', multiple=True, help='Restore only this server, can be given multiple times')
+@click.option('--max-bandwidth', '-m', type=int, help='Bytes per second for all restores together, 0 is unlimited')
+@click.option('--workers', '-w', type=int, help='Number of servers restored at the same time')
+def restore_all(server_name, max_bandwidth, workers):  # 1076
+    try:
+        _get_output(backup.restore_all(list(server_name), max_bandwidth, workers))
+    except Exception as e:
+        _get_output([str(e), 1076])
+
+@cli.command()
+def get_restore_all_progress():  # 1077
+    try:
+        _get_output(backup.restore_all_progress())
+    except Exception as e:
+        _get_output([str(e), 1077])
+
+@cli.command()
+@click.option('--max-bandwidth', '-m', type=int, help='Bytes per second to verify, 0 is unlimited')
+@click.option('--workers', '-w', type=int, help='Number of threads verifying blobs')
+@click.option('--time-limit', '-t', type=int, help='Stop after this seconds, the next call continues')
+@click.option('--restart', is_flag=True, help='Start a new pass instead of continuing the last one')
+def verify_backups(max_bandwidth, workers, time_limit, restart):  # 1078
+    try:
+        _get_output(backup.verify(max_bandwidth, workers, time_limit, not restart))
+    except Exception as e:
+        _get_output([str(e), 1078])
+
+@cli.command()
+def migrate_hash_algorithm():  # 1079
+    try:
+        _get_output(backup.migrate_hash_algorithm())
+    except Exception as e:
+        _get_output([str(e), 1079])
+
+@cli.command()
+@click.option('--server-name', '-n', multiple=True, help='Prune only this server, can be given multiple times')
+@click.option('--keep-last', type=int, help='Number of newest backups always kept')
+@click.option('--keep-hourly', type=int, help='Number of hours with one kept backup')
+@click.option('--keep-daily', type=int, help='Number of days with one kept backup')
+@click.option('--keep-weekly', type=int, help='Number of weeks with one kept backup')
+@click.option('--keep-monthly', type=int, help='Number of months with one kept backup')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed')
+def prune_backups(server_name, keep_last, keep_hourly, keep_daily, keep_weekly, keep_monthly, dry_run):  # 1080
+    try:
+        policy = {'last': keep_last, 'hourly': keep_hourly, 'daily': keep_daily, 'weekly': keep_weekly, 'monthly': keep_monthly}
+        _get_output(backup.prune(list(server_name), policy, dry_run))
+    except Exception as e:
+        _get_output([str(e), 1080])
+
+@cli.command()
+@click.option('--backup-name', '-b', prompt=True, help='Name of the backup')
+@click.option('--format', '-f', 'archive_format', type=click.Choice(['tar', 'mcworld']), default='tar', help='Format of the archive')
+@click.option('--output', '-o', help='Archive-file to write, default <backup-name>.<format>')
+def export_backup(backup_name, archive_format, output):  # 1081
+    try:
+        result = backup.export_archive(backup_name, archive_format)
+        if result[1] == 0:
+            output = output or result[0]['file-name']
+            with open(output, 'wb') as file:
+                for data in result[0]['content']:
+                    file.write(data)
+            result = {'backup-name': result[0]['backup-name'], 'file': output, 'size': os.path.getsize(output)}, 0
+        _get_output(result)
+    except Exception as e:
+        _get_output([str(e), 1081])
+
+@cli.command()
+@click.option('--input', '-i', 'archive_file', prompt=True, help='tar or .mcworld to import')
+@click.option('--format', '-f', 'archive_format', type=click.Choice(['tar', 'mcworld']), help='Format of the archive, default by the file-extension')
+@click.option('--backup-name', '-b', help='Name for this backup, default the name in the archive')
+@click.option('--server-name', '-n', help='Name of the server, required for a .mcworld')
+@click.option('--level-name', '-l', help='Name of the world')
+@click.option('--overwrite', '-o', is_flag=True, help='Will overwrite exists backup-file')
+@click.option('--compress', '-c', is_flag=False, flag_value='gzip', default=None, help='Codec for the backup-files like by create-backup')
+def import_backup(archive_file, archive_format, backup_name, server_name, level_name, overwrite, compress):  # 1082
+    try:
+        archive_format = archive_format or ('mcworld' if archive_file.endswith('.mcworld') else 'tar')
+        with open(archive_file, 'rb') as stream:
+            _get_output(backup.import_archive(stream, archive_format, backup_name, server_name, level_name, overwrite, compress))
+    except Exception as e:
+        _get_output([str(e), 1082])
+
 # JOBBER ###################################################################################
 @cli.command()
 def start_jobber():  # 1100
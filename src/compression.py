@@ -0,0 +1,144 @@
+# compression.py
+# err:27xx
+
+import gzip
+import io
+import lzma
+import zlib
+
+import helpers
+import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+AUTO = 'auto'
+AUTO_SAMPLE_SIZE = 64 * 1024
+AUTO_MIN_RATIO = 0.9  # files whose sample does not shrink below this ratio are stored uncompressed
+CODEC_MAGICS = {
+    'gzip': b'\x1f\x8b',
+    'zstd': b'\x28\xb5\x2f\xfd',
+    'lz4': b'\x04\x22\x4d\x18',
+    'lzma': b'\xfd7zXZ\x00'  # xz
+}
+CODEC_MAGIC_SIZE = max(len(magic) for magic in CODEC_MAGICS.values())
+COMPRESSED_MAGICS = list(CODEC_MAGICS.values()) + [
+    b'PK\x03\x04',  # zip, mcworld
+    b'\x89PNG',
+    b'\xff\xd8\xff'  # jpeg
+]
+
+# name: writer(fileobj, level), reader(fileobj), default-level, valid levels
+CODECS = {
+    'none': {
+        'writer': lambda fileobj, level: fileobj,
+        'reader': lambda fileobj: fileobj,
+        'level': None,
+        'levels': range(0)
+    },
+    'gzip': {
+        'writer': lambda fileobj, level: gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level),
+        'reader': lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='rb'),
+        'level': 9,
+        'levels': range(0, 10)
+    },
+    'lzma': {
+        'writer': lambda fileobj, level: lzma.LZMAFile(fileobj, 'wb', preset=level),
+        'reader': lambda fileobj: lzma.LZMAFile(fileobj, 'rb'),
+        'level': 6,
+        'levels': range(0, 10)
+    }
+}
+if zstandard is not None:
+    CODECS['zstd'] = {
+        'writer': lambda fileobj, level: zstandard.ZstdCompressor(level=level).stream_writer(fileobj, closefd=False),
+        'reader': lambda fileobj: zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False),
+        'level': 3,
+        'levels': range(1, 23)
+    }
+if lz4 is not None:
+    CODECS['lz4'] = {
+        'writer': lambda fileobj, level: lz4.frame.LZ4FrameFile(fileobj, 'wb', compression_level=level),
+        'reader': lambda fileobj: lz4.frame.LZ4FrameFile(fileobj, 'rb'),
+        'level': 0,
+        'levels': range(0, 17)
+    }
+
+def available():
+    return [name for name in CODECS] + [AUTO]
+
+def parse(compress):  # 271x
+    # accepts a codec-name with an optional level ('gzip', 'zstd:19', 'auto') or the former boolean flag.
+    # returns (codec-name, level)
+    if compress is None or compress is False or helpers.is_false(compress) or compress == '':
+        return ('none', None), 0
+    if compress is True or helpers.is_true(compress):
+        return ('gzip', CODECS['gzip']['level']), 0
+    name, _, level = str(compress).lower().partition(':')
+    if name != AUTO and name not in CODECS:
+        return f"unknown codec '{name}', available: {', '.join(available())}", 2711
+    if level == '':
+        return (name, None if name == AUTO else CODECS[name]['level']), 0
+    # the level of 'auto' is used by the codec it falls back to
+    levels = CODECS[_auto_codec() if name == AUTO else name]['levels']
+    try:
+        if int(level) not in levels:
+            raise ValueError(level)
+    except ValueError:
+        valid = f'{levels.start}-{levels.stop - 1}' if len(levels) > 0 else 'none'
+        return f"invalid level '{level}' for codec '{name}', valid: {valid}", 2712
+    return (name, int(level)), 0
+
+def select(codec, sample):
+    # resolves 'auto' for one file by its first block. everything else is returned as it is
+    name, level = codec
+    if name != AUTO:
+        return codec
+    if is_compressed(sample):
+        return ('none', None)
+    name = _auto_codec()
+    return (name, level if level is not None else CODECS[name]['level'])
+
+def is_compressed(sample):
+    if len(sample) == 0 or any(sample[:len(magic)] == magic for magic in COMPRESSED_MAGICS):
+        return True
+    # a fast trial-compression detects data that is compressed inside, like the snappy/zlib-blocks of leveldb-tables
+    sample = bytes(sample[:AUTO_SAMPLE_SIZE])
+    return len(zlib.compress(sample, 1)) > len(sample) * AUTO_MIN_RATIO
+
+def detect(sample):
+    # the codec of compressed data by its magic, 'none' for anything else
+    for name, magic in CODEC_MAGICS.items():
+        if sample[:len(magic)] == magic:
+            return name
+    return 'none'
+
+def writer(codec, fileobj):
+    name, level = codec
+    return CODECS[name]['writer'](fileobj, level)
+
+def reader(name, fileobj):
+    if name not in CODECS:
+        raise ValueError(f"codec '{name}' is not installed")
+    return CODECS[name]['reader'](fileobj)
+
+def compress(codec, data):
+    if codec[0] == 'none':
+        return data
+    buffer = io.BytesIO()
+    with writer(codec, buffer) as f_out:
+        f_out.write(data)
+    return buffer.getvalue()
+
+def _auto_codec():
+    for name in settings.BACKUP_AUTO_CODECS:
+        if name in CODECS:
+            return name
+    return 'gzip'
@@ -3,14 +3,26 @@
 
 from datetime import datetime
 import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
 import json
 import logging
 import os
 import random
 import re
+import select
 import shutil
 import string
+import struct
 import subprocess
+import threading
+import time
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len of the name behind it
 
 def is_true(value):
     if isinstance(value, str):
@@ -138,11 +150,33 @@ def parallel(process, parameters):  # 405x
             })
     return results
 
-def screen_start(screen_name, bash_command, log_file):  # 406x
+def create_throttle(bytes_per_second=0):
+    # one throttle is shared by all threads that should stay together below the bandwidth. 0 is unlimited
+    return {
+        'rate': int(bytes_per_second or 0),
+        'lock': threading.Lock(),
+        'next': time.monotonic()
+    }
+
+def throttle(limiter, size):
+    # reserves the next free slot for size bytes and waits for it, before the caller reads or writes them
+    if limiter is None or limiter['rate'] <= 0 or size <= 0:
+        return
+    with limiter['lock']:
+        now = time.monotonic()
+        start = max(now, limiter['next'])
+        limiter['next'] = start + size / limiter['rate']
+    if start > now:
+        time.sleep(start - now)
+
+def screen_start(screen_name, bash_command, log_file, log_flush=None):  # 406x
+    # log_flush: seconds screen buffers the log, None keeps the default of screen (10)
     try:
         result = subprocess.run(['screen', '-dmS', screen_name, '-L', '-Logfile', log_file, 'bash', '-c', bash_command], capture_output=True, text=True)
         if result.returncode > 0:
             return 'error at starting', 4061
+        if log_flush is not None:
+            subprocess.run(['screen', '-S', screen_name, '-X', 'logfile', 'flush', str(int(log_flush))], capture_output=True)
         return {
             'state': 'started'
         }, 0
@@ -175,6 +209,15 @@ def screen_list():  # 409x
     except subprocess.CalledProcessError as e:
         return []
 
+def screen_pid(screen_name):
+    # pid of the screen-process of the session, None if there is none
+    try:
+        result = subprocess.check_output(['screen', '-list'], stderr=subprocess.DEVNULL).decode('utf-8')
+        match = re.search(r'\t(\d+)\.' + re.escape(screen_name) + r'\s+\(', result)
+        return int(match.group(1)) if match else None
+    except subprocess.CalledProcessError as e:
+        return None
+
 def screen_wipe():
     try:
         subprocess.check_output(['screen', '-wipe'], stderr=subprocess.DEVNULL).decode('utf-8')
@@ -182,6 +225,69 @@ def screen_wipe():
     except subprocess.CalledProcessError as e:
         return False
 
+@contextlib.contextmanager
+def watch_file(file_path):
+    # a watch for wait_for_change(). inotify watches the directory, so the file can be removed and created again.
+    # without inotify (other os, no watches left) wait_for_change() falls back to sleeping
+    watch = {
+        'fd': None,
+        'name': os.path.basename(file_path).encode()
+    }
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        if libc.inotify_add_watch(fd, os.fsencode(os.path.dirname(file_path) or '.'), IN_MODIFY | IN_CREATE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch')
+        watch['fd'] = fd
+    except (OSError, AttributeError) as e:
+        logging.debug(f"no inotify for '{file_path}', polling: {e}")
+    try:
+        yield watch
+    finally:
+        if watch['fd'] is not None:
+            os.close(watch['fd'])
+
+def wait_for_change(watch, timeout, poll_interval=1):
+    # waits until the watched file is written or created, at most timeout seconds. returns False after the
+    # timeout. without inotify it sleeps poll_interval and returns True, so the caller looks again
+    if watch['fd'] is None:
+        time.sleep(max(0, min(timeout, poll_interval)))
+        return True
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        ready, _, _ = select.select([watch['fd']], [], [], remaining)
+        if len(ready) == 0:
+            return False
+        data = os.read(watch['fd'], 64 * 1024)
+        position = 0
+        while position < len(data):
+            _, _, _, name_length = INOTIFY_EVENT.unpack_from(data, position)
+            position += INOTIFY_EVENT.size
+            if data[position:position + name_length].rstrip(b'\0') == watch['name']:
+                return True
+            position += name_length
+
+def wait_for_exit(pid, timeout):
+    # waits until the process ends, at most timeout seconds, and returns whether it ended.
+    # returns None at once, if the process cannot be watched (no pidfd_open)
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        return True
+    except (AttributeError, OSError):
+        return None
+    try:
+        ready, _, _ = select.select([fd], [], [], max(0, timeout))
+        return len(ready) > 0
+    finally:
+        os.close(fd)
+
 def read_json(file_path):  # 410x
     data = {}
     try:
@@ -206,5 +312,18 @@ def write_json(file_path, data=None):  # 411x
         logging.error(f"unexpected error '{file_path}': {e}")
         return str(e), 4111
 
+def write_json_atomic(file_path, data=None):  # 413x
+    # write to a temp-file and rename it, so a crash or a reader never sees a half written file
+    temp_file = f'{file_path}.{rnd(6)}.tmp'
+    result = write_json(temp_file, data)
+    if result[1] > 0:
+        return result
+    try:
+        os.replace(temp_file, file_path)
+        return file_path, 0
+    except Exception as e:
+        logging.error(f"unexpected error '{file_path}': {e}")
+        return str(e), 4131
+
 def rnd(length):  # 412x
     return ''.join(random.choices(string.ascii_letters, k=length))
\ No newline at end of file
@@ -2,11 +2,15 @@
 # err:15xx
 
 from datetime import datetime
+import contextlib
+import fcntl
 import os
 
 import helpers
 import settings
 
+PLAYER_LOG_FILE = 'player_log.json'  # server-name: {'generation', 'offset'}, the high-water mark of the counted log-events
+
 def get_known():  # 151x
     player_json = os.path.join(settings.SERVER_PATH, 'player.json')
     if os.path.exists(player_json):
@@ -24,15 +28,126 @@ def add(name, xuid):  # 152x
         return '"xuid" is required', 1522
     
     player_json = os.path.join(settings.SERVER_PATH, 'player.json')
-    if os.path.exists(player_json):
-        json_result = helpers.read_json(player_json)
-        if json_result[1] == 0:
-            players = json_result[0]
+    with _player_lock():
+        if os.path.exists(player_json):
+            json_result = helpers.read_json(player_json)
+            if json_result[1] == 0:
+                players = json_result[0]
+            else:
+                return 'cannot parse player-json', 1523
         else:
-            return 'cannot parse player-json', 1523
-    else:
+            players = []
+
+        result = _add(players, name, xuid)
+        if result[0]['state'] == 'added':
+            write_result = _write_players(players)
+            if write_result[1] > 0:
+                return 'cannot write player-json', 1524
+    return result
+
+def start_playtime(name, time=None):  # 153x
+    if helpers.is_empty(name):
+        return '"user-name" is required', 1531
+    if helpers.is_empty(time):
+        time = datetime.now()
+    
+    player_json = os.path.join(settings.SERVER_PATH, 'player.json')
+    with _player_lock():
+        if not os.path.exists(player_json):
+            return 'player-json does not exists', 1532
+        else:
+            json_result = helpers.read_json(player_json)
+            if json_result[1] == 0:
+                players = json_result[0]
+            else:
+                return 'cannot parse player-json', 1533
+
+        result = _start_playtime(players, name, time)
+        if result[1] == 0 and result[0]['state'] == 'updated':
+            write_result = _write_players(players)
+            if write_result[1] > 0:
+                return 'cannot write player-json', 1534
+    return result
+
+def stop_playtime(name, time=None):  # 154x
+    if helpers.is_empty(name):
+        return '"user-name" is required', 1541
+    if helpers.is_empty(time):
+        time = datetime.now()
+    
+    player_json = os.path.join(settings.SERVER_PATH, 'player.json')
+    with _player_lock():
+        if not os.path.exists(player_json):
+            return 'player-json does not exists', 1542
+        else:
+            json_result = helpers.read_json(player_json)
+            if json_result[1] == 0:
+                players = json_result[0]
+            else:
+                return 'cannot parse player-json', 1543
+
+        result = _stop_playtime(players, name, time)
+        if result[1] == 0 and result[0]['state'] == 'updated':
+            write_result = _write_players(players)
+            if write_result[1] > 0:
+                return 'cannot write player-json', 1544
+    return result
+
+def apply_log_events(server_name, generation, offset, events):  # 157x
+    # applies the player-events of a server-log exactly once. events up to the high-water mark of the same
+    # log-generation were counted already, by this or another process. offset: the log is parsed up to here,
+    # events: [{'offset' (end of the line), 'type' (connected, disconnected), 'name', 'xuid', 'time'}]
+    player_json = os.path.join(settings.SERVER_PATH, 'player.json')
+    marks_json = os.path.join(settings.SERVER_PATH, PLAYER_LOG_FILE)
+    with _player_lock():
+        marks = {}
+        if os.path.exists(marks_json):
+            json_result = helpers.read_json(marks_json)
+            if json_result[1] > 0:
+                return 'cannot parse player-log-json', 1571
+            marks = json_result[0]
+        mark = marks.get(server_name, {})
+        counted = mark.get('offset', 0) if mark.get('generation') == generation else 0
+        pending = [event for event in events if event['offset'] > counted]
+        if len(pending) == 0:
+            return {'applied': 0}, 0
+
         players = []
+        if os.path.exists(player_json):
+            json_result = helpers.read_json(player_json)
+            if json_result[1] > 0:
+                return 'cannot parse player-json', 1572
+            players = json_result[0]
+        for event in pending:
+            if event['type'] == 'connected':
+                _add(players, event['name'], event['xuid'])
+                _start_playtime(players, event['name'], event['time'])
+            else:
+                _stop_playtime(players, event['name'], event['time'])
 
+        # player.json first: if the mark is lost, the events come again and are 'up-to-date' by their last-seen
+        write_result = _write_players(players)
+        if write_result[1] > 0:
+            return 'cannot write player-json', 1573
+        marks[server_name] = {'generation': generation, 'offset': max(offset, counted)}
+        write_result = helpers.write_json_atomic(marks_json, marks)
+        if write_result[1] > 0:
+            return 'cannot write player-log-json', 1574
+    return {'applied': len(pending)}, 0
+
+def get_log_mark(server_name, generation):  # 158x
+    # the offset in the log of the server, up to which its player-events are counted
+    marks_json = os.path.join(settings.SERVER_PATH, PLAYER_LOG_FILE)
+    if not os.path.exists(marks_json):
+        return {'offset': 0}, 0
+    json_result = helpers.read_json(marks_json)
+    if json_result[1] > 0:
+        return 'cannot parse player-log-json', 1581
+    mark = json_result[0].get(server_name, {})
+    return {'offset': mark.get('offset', 0) if mark.get('generation') == generation else 0}, 0
+
+def _add(players, name, xuid):
+    # the changes of add(), start_playtime() and stop_playtime() on the loaded players, without reading and writing
     for player in players:
         if player['xuid'] == xuid:
             return {
@@ -47,33 +162,13 @@ def add(name, xuid):  # 152x
         'playtime': 0,
         'last-seen': None
     })
-
-    write_result = helpers.write_json(player_json, players)
-    if write_result[1] > 0:
-        return 'cannot write player-json', 1524
-    
     return {
         'name': name,
         'xuid': xuid,
         'state': 'added'
     }, 0
 
-def start_playtime(name, time=None):  # 153x
-    if helpers.is_empty(name):
-        return '"user-name" is required', 1531
-    if helpers.is_empty(time):
-        time = datetime.now()
-    
-    player_json = os.path.join(settings.SERVER_PATH, 'player.json')
-    if not os.path.exists(player_json):
-        return 'player-json does not exists', 1532
-    else:
-        json_result = helpers.read_json(player_json)
-        if json_result[1] == 0:
-            players = json_result[0]
-        else:
-            return 'cannot parse player-json', 1533
-
+def _start_playtime(players, name, time):
     for player in players:
         if player['name'] == name:
             last_seen = None
@@ -85,37 +180,15 @@ def start_playtime(name, time=None):  # 153x
                     'xuid': player['xuid'],
                     'state': 'up-to-date'
                 }, 0
-            else:
-                player['last-seen'] = time.strftime('%Y-%m-%d %H:%M:%S')
-
-            write_result = helpers.write_json(player_json, players)
-            if write_result[1] > 0:
-                return 'cannot write player-json', 1534
-            
+            player['last-seen'] = time.strftime('%Y-%m-%d %H:%M:%S')
             return {
                 'name': player['name'],
                 'xuid': player['xuid'],
                 'state': 'updated'
             }, 0
-    
     return 'player-name not in player-json', 1535
 
-def stop_playtime(name, time=None):  # 154x
-    if helpers.is_empty(name):
-        return '"user-name" is required', 1541
-    if helpers.is_empty(time):
-        time = datetime.now()
-    
-    player_json = os.path.join(settings.SERVER_PATH, 'player.json')
-    if not os.path.exists(player_json):
-        return 'player-json does not exists', 1542
-    else:
-        json_result = helpers.read_json(player_json)
-        if json_result[1] == 0:
-            players = json_result[0]
-        else:
-            return 'cannot parse player-json', 1543
-
+def _stop_playtime(players, name, time):
     for player in players:
         if player['name'] == name:
             last_seen = None
@@ -127,24 +200,29 @@ def stop_playtime(name, time=None):  # 154x
                     'xuid': player['xuid'],
                     'state': 'up-to-date'
                 }, 0
-            else:
+            if last_seen != None:
                 player['playtime'] += (time - last_seen).total_seconds()
-                player['last-seen'] = time.strftime('%Y-%m-%d %H:%M:%S')
-                print(player)
-                print(players)
-
-            write_result = helpers.write_json(player_json, players)
-            if write_result[1] > 0:
-                return 'cannot write player-json', 1544
-            
+            player['last-seen'] = time.strftime('%Y-%m-%d %H:%M:%S')
             return {
                 'name': player['name'],
                 'xuid': player['xuid'],
                 'state': 'updated'
             }, 0
-    
     return 'player-name not in player-json', 1545
 
+@contextlib.contextmanager
+def _player_lock():
+    # player.json is changed by the api, the cli and the log-parsing of every server
+    with open(os.path.join(settings.SERVER_PATH, 'player.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _write_players(players):
+    return helpers.write_json_atomic(os.path.join(settings.SERVER_PATH, 'player.json'), players)
+
 def update_permission(server_name, name, permission=None):  # 155x
     if helpers.is_empty(server_name):
         return '"server-name" is required', 1551
@@ -3,11 +3,16 @@
 
 from zipfile import ZipFile
 from datetime import datetime
+import copy
+import hashlib
+import heapq
 import logging
+import mmap
 import os
 import re
 import requests
 import shutil
+import threading
 import time
 
 import helpers
@@ -16,6 +21,12 @@ import settings
 import world
 
 version_file = os.path.join(settings.DOWNLOADED_PATH, f'versions.json')
+SERVER_START_TIMEOUT = 90  # seconds
+SERVER_STOP_TIMEOUT = 90
+LOG_READ_SIZE = 4 * 1024 * 1024  # a big log is parsed in blocks
+LOG_HEAD_SIZE = 64  # first bytes of a log, a log with other first bytes is a new one even with the same inode
+_log_tails = {}  # server-name: {'inode', 'head', 'offset', 'state', 'events'} of the log-lines parsed so far
+_log_tails_lock = threading.Lock()
 #logging.basicConfig(level=logging.DEBUG)
 
 def get_online_version(preview=None):  # 110x
@@ -319,18 +330,25 @@ def stop(server_name=None, wait_for_disconnected_user=False):  # 116x
                 say_to_server(server_name, f'This server will shutdown in {i * sec} seconds. Please finish your game.')
             time.sleep(sec)
             
+    screen_pid = helpers.screen_pid(server_name)
     result = send_command(server_name, 'stop')
     if result[1] != 0:
         return 'cannot send stop-command', 1162, result
 
-    for i in range(90):
-        time.sleep(1)
+    # the screen-session ends with the server. without pidfd (or pid) wait_for_exit returns at once and it is polled
+    deadline = time.time() + SERVER_STOP_TIMEOUT
+    if screen_pid is not None:
+        helpers.wait_for_exit(screen_pid, SERVER_STOP_TIMEOUT)
+    while True:
         if not is_running(server_name):
             return {
                 'server-name': server_name,
                 'state': 'stopped',
                 'times': int(time.time() - start_time)
             }, 0
+        if time.time() >= deadline:
+            break
+        time.sleep(1)
             
     try:
         helpers.screen_stop(server_name)
@@ -375,6 +393,40 @@ def send_command(server_name=None, command=None):  # 118x
         'command': command
     }, 0
 
+def hold_save(server_name=None, timeout=None):  # 134x
+    # holds the saving of a running server until its files are ready to be copied.
+    # returns {path relative to the worlds-directory: bytes to copy}. resume_save() has to follow in any case
+    if helpers.is_empty(server_name):
+        return '"server-name" is required', 1341
+    if not is_running(server_name):
+        return f'server not running "{server_name}"', 1342
+
+    log_file = os.path.join(settings.LOGS_PATH, server_name)
+    offset = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+    result = send_command(server_name, 'save hold')
+    if result[1] > 0:
+        return 'cannot send save hold', 1343, result
+
+    deadline = time.time() + (settings.HOT_BACKUP_TIMEOUT if timeout is None else timeout)
+    while time.time() < deadline:
+        time.sleep(settings.HOT_BACKUP_POLL_INTERVAL)
+        result = send_command(server_name, 'save query')
+        if result[1] > 0:
+            return 'cannot send save query', 1344, result
+        files = _parse_save_query(log_file, offset)
+        if files is not None:
+            return files, 0
+    return 'timeout while waiting for save query', 1345
+
+def resume_save(server_name=None):  # 135x
+    result = send_command(server_name, 'save resume')
+    if result[1] > 0:
+        return 'cannot send save resume', 1351, result
+    return {
+        'server-name': server_name,
+        'state': 'resumed'
+    }, 0
+
 def get_created():
     try:
         directory_contents = os.listdir(settings.SERVER_PATH)
@@ -414,65 +466,192 @@ def get_version(server_name):  # 119x
         return f'cannot get version', 1191, result
 
 def parse_log(server_name=None):  # 120x
+    # only the lines written since the last call are parsed. the parse-state and the offset behind the last
+    # complete line are kept per server, a removed, replaced or truncated log is parsed from the beginning.
+    # the player-events of the new lines are counted in player.json once, even by several processes
     if helpers.is_empty(server_name):
         return '"server-name" is required', 1201
     
     log_file = os.path.join(settings.LOGS_PATH, server_name)
-    if not os.path.exists(log_file):
-        return 'no log found', 1202
-    
-    state = {
-        'server-name': server_name
+    with _log_tails_lock:
+        try:
+            with open(log_file, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                tail = _log_tails.get(server_name)
+                if tail is None or tail['inode'] != (stat.st_dev, stat.st_ino) or tail['offset'] > stat.st_size \
+                or file.read(len(tail['head'])) != tail['head']:
+                    file.seek(0)
+                    tail = {
+                        'inode': (stat.st_dev, stat.st_ino),
+                        'head': file.read(LOG_HEAD_SIZE),
+                        'offset': 0,
+                        'state': {'server-name': server_name},
+                        'events': []  # not yet counted player-events
+                    }
+                    _log_tails[server_name] = tail
+                    if settings.LOG_LAST_SESSION_ONLY and stat.st_size > 0:
+                        tail['offset'] = _last_session_offset(server_name, file, tail)
+                elif len(tail['head']) < LOG_HEAD_SIZE:  # the log was shorter than the head before
+                    file.seek(0)
+                    tail['head'] = file.read(LOG_HEAD_SIZE)
+                file.seek(tail['offset'])
+                rest = b''
+                for data in iter(lambda: file.read(LOG_READ_SIZE), b''):
+                    data = rest + data
+                    complete = data.rfind(b'\n') + 1  # a line without newline is still written, it is parsed by the next call
+                    tail['state'] = _parse_log_lines(server_name, tail['state'], data[:complete], tail['offset'], tail['events'])
+                    tail['offset'] += complete
+                    rest = data[complete:]
+        except FileNotFoundError:
+            _log_tails.pop(server_name, None)
+            return 'no log found', 1202
+        except OSError as e:
+            logging.error(f"unexpected error: {e}")
+            return str(e), 1203
+
+        generation = _log_generation(tail)
+        if len(tail['events']) > 0 and generation is not None:
+            result = player.apply_log_events(server_name, generation, tail['offset'], tail['events'])
+            if result[1] == 0:
+                tail['events'] = []
+            else:
+                logging.error(f"cannot count player-events of '{server_name}': {result}")  # tried again by the next call
+        return copy.deepcopy(tail['state']), 0
+
+def _log_generation(tail):
+    # tells apart the logs of the server-starts, so it needs the complete head
+    return hashlib.sha256(tail['head']).hexdigest() if len(tail['head']) == LOG_HEAD_SIZE else None
+
+def _last_session_offset(server_name, file, tail):
+    # the state only depends on the lines behind the last server-start. the log is mapped and searched backwards
+    # for it, so the pages in front are never read. if the sessions in front have player-events that are not
+    # counted yet, parsing starts at the server-start of the session with the mark, so a disconnect is parsed
+    # together with its connect
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as log_map:
+        line_start = _session_start(log_map, len(log_map))
+        if line_start < 0:
+            return 0
+        counted = 0
+        generation = _log_generation(tail)
+        if generation is not None:
+            result = player.get_log_mark(server_name, generation)
+            counted = result[0]['offset'] if result[1] == 0 else 0
+        if counted < line_start and log_map.find(b' INFO] Player ', counted, line_start) >= 0:
+            return max(_session_start(log_map, counted), 0)
+        return line_start
+
+def _session_start(log_map, end):
+    # offset of the last line with a server-start in front of end, -1 without one
+    position = log_map.rfind(b' INFO] Starting Server', 0, end)
+    while position >= 0:
+        line_start = log_map.rfind(b'\n', 0, position) + 1
+        if _log_prefix.fullmatch(log_map, line_start, position + 1) is not None:
+            return line_start
+        position = log_map.rfind(b' INFO] Starting Server', 0, position)
+    return -1
+
+def _parse_log_lines(server_name, state, data, offset, events):
+    # returns the state after the complete lines in data, a new server-start begins a new state. the regexes
+    # search the events in the bytes at c-speed, only their lines are decoded. player-events are appended to
+    # events with the offset behind their line, data starts at offset in the log
+    data = b'\n' + data  # every line starts behind a newline. shifted by one, the newline of a line is at the offset behind it
+    matches = [pattern.finditer(data) for pattern in [_log_timed, _log_untimed] if pattern is not None]
+    for match in heapq.merge(*matches, key=lambda match: match.start()):
+        timed, handler = _log_handlers[match.lastgroup]
+        log_time = None
+        if timed:
+            prefix = _log_prefix.fullmatch(data, data.rfind(b'\n', 0, match.start()) + 1, match.start())
+            if prefix is None:
+                continue
+            log_time = prefix.group(1).decode()
+            if prefix.group(2) != b'000':
+                log_time += '.' + prefix.group(2).decode() + '000'  # like str() of the datetime
+        values = {name: value.decode(errors='replace') for name, value in match.groupdict().items() if value is not None}
+        line = {'server-name': server_name, 'time': log_time, 'offset': offset + data.find(b'\n', match.end()), 'events': events}
+        state = handler(state, values, line)
+    return state
+
+def _log_starting(state, values, line):
+    return {
+        'server-name': line['server-name'],
+        'start-time': line['time'],
+        'state': 'starting'
     }
 
-    with open(log_file, 'r') as file:
-        for line in file:
-            # Suche nach Zeilen mit Datum/Zeit im Format [YYYY-MM-DD HH:mm:ss:ms INFO]
-            match = re.match(r'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}:\d{3}) INFO\]', line)
-            if match:
-                timestamp = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S:%f')
-                message = line[len(match.group(0)) + 1:].strip()
-
-                if "Starting Server" in message:
-                    state = {
-                        'server-name': server_name,
-                        "start-time": str(timestamp),
-                        "state": "starting"
-                    }
-                elif "Server started" in message:
-                    state['started-time'] = str(timestamp)
-                    state['state'] = "started"
-                elif "Level Name" in message:
-                    state['level-name'] = re.search(r'Level Name: (.+)', message).group(1)
-                elif "Game mode" in message:
-                    state['gamemode'] = re.search(r'Game mode: (.+)', message).group(1)
-                elif "Difficulty" in message:
-                    state['difficulty'] = re.search(r'Difficulty: (.+)', message).group(1)
-                elif "Player connected" in message:
-                    if 'user-sessions' not in state:
-                        state['user-sessions'] = {}
-                    if 'user-count' not in state:
-                        state['user-count'] = 0
-                    result = re.search(r'Player connected: (\w+), xuid: ([0-9]+)', message)
-                    user_name = result.group(1)
-                    xuid = result.group(2)
-                    state['user-sessions'][user_name] = {'start': str(timestamp)}
-                    state['user-count'] += 1
-                    state['state'] = "connected"
-                    player.add(user_name, xuid)
-                    player.start_playtime(user_name, timestamp)
-                elif "Player disconnected" in message:
-                    user_name = re.search(r'Player disconnected: (\w+)', message).group(1)
-                    if 'user-sessions' in state and user_name in state['user-sessions']:
-                        state['user-sessions'][user_name]['end'] = str(timestamp)
-                        state['user-count'] -= 1
-                        state['state'] = 'connected' if state['user-count'] > 0 else 'disconnected'
-                        player.stop_playtime(user_name, timestamp)
-                elif "Server stop requested" in message:
-                    state['stop-time'] = str(timestamp)
-                    state['state'] = "stopped"
-
-    return state, 0
+def _log_started(state, values, line):
+    state['started-time'] = line['time']
+    state['state'] = 'started'
+    return state
+
+def _log_value(key, group):
+    def handler(state, values, line):
+        state[key] = values[group]
+        return state
+    return handler
+
+def _log_connected(state, values, line):
+    user_name = values['connected_name']
+    state.setdefault('user-sessions', {})[user_name] = {'start': line['time']}
+    state['user-count'] = state.get('user-count', 0) + 1
+    state['state'] = 'connected'
+    line['events'].append({'offset': line['offset'], 'type': 'connected', 'name': user_name, 'xuid': values['connected_xuid'],
+        'time': datetime.fromisoformat(line['time'])})
+    return state
+
+def _log_disconnected(state, values, line):
+    user_name = values['disconnected_name']
+    if 'user-sessions' in state and user_name in state['user-sessions']:
+        state['user-sessions'][user_name]['end'] = line['time']
+        state['user-count'] -= 1
+        state['state'] = 'connected' if state['user-count'] > 0 else 'disconnected'
+        line['events'].append({'offset': line['offset'], 'type': 'disconnected', 'name': user_name, 'time': datetime.fromisoformat(line['time'])})
+    return state
+
+def _log_stop_requested(state, values, line):
+    state['stop-time'] = line['time']
+    state['state'] = 'stopped'
+    return state
+
+def _log_save_state(save_state):
+    def handler(state, values, line):
+        state['save-state'] = save_state
+        return state
+    return handler
+
+# (pattern of the message, handler(state, values, line) returning the new state, timed). values are the named
+# groups of the pattern, line has 'server-name', 'time', 'offset' and 'events'. a timed message needs the prefix
+# "[YYYY-MM-DD HH:mm:ss:ms INFO] ", the answers of console-commands have none. a pattern must not pass a line-end
+LOG_EVENTS = [
+    (r'Starting Server', _log_starting, True),
+    (r'Server started', _log_started, True),
+    (r'Level Name: (?P<level_name>.+?)[ \t\r]*$', _log_value('level-name', 'level_name'), True),
+    (r'Game mode: (?P<gamemode>.+?)[ \t\r]*$', _log_value('gamemode', 'gamemode'), True),
+    (r'Difficulty: (?P<difficulty>.+?)[ \t\r]*$', _log_value('difficulty', 'difficulty'), True),
+    (r'Player connected: (?P<connected_name>\w+), xuid: (?P<connected_xuid>[0-9]+)', _log_connected, True),
+    (r'Player disconnected: (?P<disconnected_name>\w+)', _log_disconnected, True),
+    (r'Server stop requested', _log_stop_requested, True),
+    (r'Saving\.\.\.', _log_save_state('holding'), False),  # save hold
+    (r'Data saved\. Files are now ready to be copied', _log_save_state('ready'), False),  # save query
+    (r'Changes to the (?:level|world) are resumed', _log_save_state('resumed'), False)  # save resume
+]
+
+def add_log_event(pattern, handler, timed=True):
+    # parse_log handles lines with the message-pattern from now on
+    global _log_timed, _log_untimed, _log_handlers
+    LOG_EVENTS.append((pattern, handler, timed))
+    _log_timed, _log_untimed, _log_handlers = _compile_log_events()
+
+def _compile_log_events():
+    # one regex for the timed and one for the other events, both start with a literal that the regex-engine
+    # searches fast. the group of the event is the last that is closed in a match
+    def compile_events(prefix, timed):
+        alternatives = [f'(?P<event{index}>{pattern})' for index, (pattern, _, is_timed) in enumerate(LOG_EVENTS) if is_timed == timed]
+        return re.compile((prefix + '(?:' + '|'.join(alternatives) + ')').encode(), re.MULTILINE) if len(alternatives) > 0 else None
+    handlers = {f'event{index}': (timed, handler) for index, (_, handler, timed) in enumerate(LOG_EVENTS)}
+    return compile_events(r'INFO\] ', True), compile_events(r'\n', False), handlers
+
+_log_prefix = re.compile(rb'\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}):(\d{3}) ')  # of a timed line, in front of INFO]
+_log_timed, _log_untimed, _log_handlers = _compile_log_events()
 
 def start_simple(server_name=None): # 124x
     if helpers.is_empty(server_name):
@@ -508,27 +687,32 @@ def start_simple(server_name=None): # 124x
     server_log = os.path.join(settings.LOGS_PATH, server_name)
     if os.path.exists(server_log):
         os.remove(server_log)
-    result = helpers.screen_start(server_name, f'cd {server_path} ; LD_LIBRARY_PATH=. ; ./bedrock_server', server_log)
-    if result[1] > 0:
-        return 'error at startup in the screen-session', 1244
+    # the watch exists before the log, so no write of the server is missed. every write wakes up the wait
+    with helpers.watch_file(server_log) as watch:
+        result = helpers.screen_start(server_name, f'cd {server_path} ; LD_LIBRARY_PATH=. ; ./bedrock_server', server_log, settings.SCREEN_LOG_FLUSH)
+        if result[1] > 0:
+            return 'error at startup in the screen-session', 1244
 
-    # wait for running
-    for i in range(90):
-        time.sleep(1)
-        log_result = parse_log(server_name)
-        states = log_result[0] if log_result[1] == 0 else {}
-        if 'start-time' in states and 'started-time' in states and states['start-time'] and states['started-time'] and states['start-time'] < states['started-time']:
-            logging.debug(f'successfully started {server_name}')
-            version_result = get_version(server_name)
-            return {
-                'server-name': server_name,
-                'version': version_result[0]['version'] if version_result[1] == 0 else 'unknown',
-                'branch': version_result[0]['branch'] if version_result[1] == 0 else 'unknown',
-                'state': 'started',
-                'times': int(time.time() - start_time),
-                'log': states
-            }, 0
-        logging.debug(f'starting {server_name}')
+        # wait for running
+        deadline = time.time() + SERVER_START_TIMEOUT
+        while True:
+            log_result = parse_log(server_name)
+            states = log_result[0] if log_result[1] == 0 else {}
+            if 'start-time' in states and 'started-time' in states and states['start-time'] and states['started-time'] and states['start-time'] < states['started-time']:
+                logging.debug(f'successfully started {server_name}')
+                version_result = get_version(server_name)
+                return {
+                    'server-name': server_name,
+                    'version': version_result[0]['version'] if version_result[1] == 0 else 'unknown',
+                    'branch': version_result[0]['branch'] if version_result[1] == 0 else 'unknown',
+                    'state': 'started',
+                    'times': int(time.time() - start_time),
+                    'log': states
+                }, 0
+            logging.debug(f'starting {server_name}')
+            if time.time() >= deadline:
+                break
+            helpers.wait_for_change(watch, deadline - time.time())
 
     # abourt
     helpers.screen_stop(server_name)
@@ -766,6 +950,25 @@ def _compare_versions(version1, version2):  # 1315-1319
     else:
         return 0
 
+def _parse_save_query(log_file, offset):
+    # the answer of a successful save query is a line "Data saved. Files are now ready to be copied."
+    # followed by one line: <level>/db/000005.ldb:1234, <level>/level.dat:2578, ...
+    if not os.path.exists(log_file):
+        return None
+    with open(log_file, 'rb') as file:
+        file.seek(offset)
+        lines = file.read().decode('utf-8', errors='replace').split('\n')
+    for i in range(len(lines) - 2, -1, -1):  # the last element is an unfinished line
+        if 'Files are now ready to be copied' in lines[i]:
+            if i + 1 >= len(lines) - 1:
+                return None  # the file-list is not written yet
+            files = {}
+            for entry in lines[i + 1].strip().split(', '):
+                path, _, length = entry.rpartition(':')
+                files[path] = int(length)
+            return files
+    return None
+
 def _search_version(version):  # 132x
     json_result = _get_knowing_versions()
     if json_result[1] > 0:
@@ -7,6 +7,31 @@ SERVER_PATH = '/entrypoint/server'
 LOGS_PATH = '/entrypoint/logs'
 BACKUPS_PATH = '/entrypoint/backups'
 INCREMENTAL_PATH = os.path.join(BACKUPS_PATH, "incremental")
+HASH_CACHE_PATH = os.path.join(BACKUPS_PATH, "cache")
+HASH_ALGORITHM = 'sha512'  # sha512, blake2b or sha256 for new backups. migrate-hash-algorithm converts the existing ones
+BACKUP_CHUNK_SIZE = 1024 * 1024  # read-buffer per file while hashing and copying
+BACKUP_WORKERS = os.cpu_count() or 1  # threads hashing and compressing files within one backup
+BACKUP_ALL_WORKERS = 2  # servers backed up at the same time by backup-all-server, they share BACKUP_WORKERS
+BACKUP_MAX_BANDWIDTH = 0  # bytes per second read by all backups of backup-all-server together, 0 is unlimited
+RESTORE_ALL_WORKERS = 4  # servers restored at the same time by restore-all
+RESTORE_MAX_BANDWIDTH = 0  # bytes per second for all restores of restore-all together, 0 is unlimited
+SCRUB_WORKERS = 2  # threads verifying blobs
+SCRUB_MAX_BANDWIDTH = 20 * 1024 * 1024  # bytes per second verified, so a scrub can run beside live servers. 0 is unlimited
+PACK_THRESHOLD = 16 * 1024  # smaller backup-files are appended to pack-files instead of getting an own inode
+PACK_MAX_SIZE = 64 * 1024 * 1024
+SWEEP_MIN_AGE = 24 * 3600  # seconds, rebuild-backup-catalog removes unreferenced blobs only when they are older
+BACKUP_CHUNKING = False  # splits big files into content-defined chunks, so a changed file only stores its changed chunks
+CHUNKING_MIN_FILE_SIZE = 1024 * 1024  # smaller files are stored as a whole
+CHUNK_MIN_SIZE = 16 * 1024
+CHUNK_AVG_SIZE = 64 * 1024  # a power of two
+CHUNK_MAX_SIZE = 256 * 1024
+RETENTION_POLICY = {'last': 3, 'hourly': 24, 'daily': 7, 'weekly': 4, 'monthly': 12}  # backups kept per server and world by prune-backups
+RETENTION_POLICIES = {}  # server-name: policy, overrides parts of RETENTION_POLICY for single servers
+SCREEN_LOG_FLUSH = 0  # seconds screen buffers the log of a server before writing it, None keeps the default of screen (10)
+LOG_LAST_SESSION_ONLY = True  # parse_log starts a new log at its last server-start, not at the beginning
+HOT_BACKUP_TIMEOUT = 60  # seconds to wait for a running server to get its files ready for a hot backup
+HOT_BACKUP_POLL_INTERVAL = 1
+BACKUP_AUTO_CODECS = ['zstd', 'lz4', 'gzip']  # codec 'auto' uses the first installed one for compressible files
 
 JOBBER_SOCKET_PATH = '/var/jobber/0'
 JOBBER_CONFIG_FILE = '/app/jobber.yml'
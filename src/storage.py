@@ -0,0 +1,644 @@
+# storage.py
+# err:26xx
+
+import contextlib
+import fcntl
+import hashlib
+import io
+import logging
+import mmap
+import os
+import threading
+import time
+
+import chunking
+import compression
+import helpers
+import settings
+
+PACKS_DIR = 'packs'
+PACK_SEQUENCE_FILE = '.sequence'  # the last pack-number
+MIGRATED_FILE = '.migrated'  # written by a finished migration, the api skips it on start then
+FICLONE = 0x40049409  # ioctl of linux/fs.h
+
+_migration_lock = threading.Lock()
+_pack_lock = threading.RLock()
+_pack_lock_depth = 0
+_pack_index = {}  # hash: (pack-name, offset, length)
+_pack_files = {}  # idx-name: (inode, bytes read)
+_pack_maps = {}  # pack-name: (inode, size, mmap)
+
+HASH_ALGORITHMS = {
+    'sha512': hashlib.sha512,
+    'blake2b': hashlib.blake2b,
+    'sha256': hashlib.sha256
+}
+
+def make_key(algorithm, digest):
+    # blobs are named <algorithm>-<hex-digest>, sha512 keeps the plain hex-digest of the first store
+    return digest if algorithm == 'sha512' else f'{algorithm}-{digest}'
+
+def key_algorithm(file_hash):
+    return file_hash.split('-', 1)[0] if '-' in file_hash else 'sha512'
+
+def new_hash(algorithm):
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"unknown hash-algorithm '{algorithm}', available: {', '.join(HASH_ALGORITHMS)}")
+    return HASH_ALGORITHMS[algorithm]()
+
+def blob_path(file_hash):
+    # fan-out layout: incremental/ab/cd/abcd... by the hex-digest, also for keys with an algorithm
+    digest = file_hash.rpartition('-')[2]
+    return os.path.join(settings.INCREMENTAL_PATH, digest[:2], digest[2:4], file_hash)
+
+def find(file_hash):
+    # the one lookup for all loose blobs. blobs of the old flat layout are found until they are migrated
+    for path in [blob_path(file_hash), os.path.join(settings.INCREMENTAL_PATH, file_hash)]:
+        if os.path.exists(path):
+            return path
+    return None
+
+def exists(file_hash):
+    return find(file_hash) is not None or _find_packed(file_hash) is not None
+
+def open_blob(file_hash):
+    # a running migration or compaction can move a blob between lookup and open(), so the lookup is repeated once
+    for attempt in range(2):
+        path = find(file_hash)
+        if path is not None:
+            try:
+                return open(path, 'rb')
+            except FileNotFoundError:
+                continue
+        entry = _find_packed(file_hash, attempt > 0)
+        if entry is not None:
+            try:
+                return io.BytesIO(_read_packed(entry))
+            except FileNotFoundError:
+                continue
+    raise FileNotFoundError(f'blob not found: {file_hash}')
+
+def read_blob(file_hash, codec):
+    # returns a readable file-object with the original content of the blob
+    f_blob = open_blob(file_hash)
+    if codec == 'none':
+        return f_blob
+    return compression.reader(codec, f_blob)
+
+def copy_blob(file_hash, codec, output_file, limiter=None):
+    # writes the original content of a blob to output_file and returns (strategy, size).
+    # uncompressed loose blobs are cloned or copied by the kernel. never hardlinked, bedrock rewrites its files in place.
+    # limiter: helpers.create_throttle() shared with other copies
+    if codec == 'none':
+        path = find(file_hash)
+        if path is not None:
+            try:
+                with open(path, 'rb') as f_in, open(output_file, 'wb') as f_out:
+                    strategy = _copy_file(f_in, f_out, limiter)
+                    return strategy, os.fstat(f_out.fileno()).st_size
+            except FileNotFoundError:
+                pass  # moved by a migration meanwhile, it is read like a packed blob
+    with read_blob(file_hash, codec) as f_in, open(output_file, 'wb') as f_out:
+        _copy_stream(f_in, f_out, limiter)
+        return 'copy' if codec == 'none' else 'decompress', f_out.tell()
+
+def verify_blob(file_hash, codec, limiter=None):
+    # hashes the original content of a blob again. returns 'ok', 'corrupt' or 'missing'
+    file_hash_now = new_hash(key_algorithm(file_hash))
+    buffer = bytearray(settings.BACKUP_CHUNK_SIZE)
+    view = memoryview(buffer)
+    try:
+        with read_blob(file_hash, codec) as f_in:
+            while True:
+                length = f_in.readinto(buffer)
+                if not length:
+                    break
+                helpers.throttle(limiter, length)
+                file_hash_now.update(view[:length])
+    except FileNotFoundError:
+        return 'missing'
+    except Exception as e:
+        # broken compressed data raises different errors for every codec
+        logging.error(f"cannot read blob {file_hash}: {e}")
+        return 'corrupt'
+    return 'ok' if make_key(key_algorithm(file_hash), file_hash_now.hexdigest()) == file_hash else 'corrupt'
+
+def stored_size(file_hash):
+    path = find(file_hash)
+    if path is not None:
+        return os.path.getsize(path)
+    entry = _find_packed(file_hash, True)
+    if entry is None:
+        raise FileNotFoundError(f'blob not found: {file_hash}')
+    return entry[2]
+
+def detect_codec(file_hash):
+    # only for blobs stored before the codec was recorded in the backup-file
+    with open_blob(file_hash) as f_blob:
+        return compression.detect(f_blob.read(compression.CODEC_MAGIC_SIZE))
+
+def hash_file(input_file, algorithm='sha512'):
+    # the key a file would get in the store, without storing it
+    file_hash = new_hash(algorithm)
+    buffer = bytearray(settings.BACKUP_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(input_file, 'rb') as f_in:
+        while True:
+            length = f_in.readinto(buffer)
+            if not length:
+                break
+            file_hash.update(view[:length])
+    return make_key(algorithm, file_hash.hexdigest())
+
+def store(input_file, codec=('none', None), length=None, algorithm='sha512', limiter=None):
+    # input_file: a path or a readable file-object (length is required then), codec: (name, level) of compression.parse(),
+    # length: only the first bytes of the file are stored, limiter: helpers.create_throttle() for the bytes read.
+    # returns (key, codec-name, stored-size). codec-name and stored-size are None, if the blob already existed
+    remaining = os.path.getsize(input_file) if length is None else length
+    if remaining < settings.PACK_THRESHOLD:
+        helpers.throttle(limiter, remaining)
+        with _open_input(input_file) as f_in:
+            return _store_data(f_in.read(remaining), codec, algorithm)
+
+    # hash and copy in one pass with a fixed buffer, so big files never get loaded into memory
+    temp_file = os.path.join(settings.INCREMENTAL_PATH, f'.{helpers.rnd(12)}.tmp')
+    file_hash = new_hash(algorithm)
+    buffer = bytearray(settings.BACKUP_CHUNK_SIZE)
+    view = memoryview(buffer)
+    try:
+        with _open_input(input_file) as f_in:
+            length = f_in.readinto(view[:min(remaining, len(buffer))])
+            codec = compression.select(codec, view[:length])
+            with open(temp_file, 'wb') as f_raw, compression.writer(codec, f_raw) as f_out:
+                while length:
+                    helpers.throttle(limiter, length)
+                    file_hash.update(view[:length])
+                    f_out.write(view[:length])
+                    remaining -= length
+                    length = f_in.readinto(view[:min(remaining, len(buffer))])
+        file_hash = make_key(algorithm, file_hash.hexdigest())
+        if exists(file_hash):
+            os.remove(temp_file)
+            return file_hash, None, None
+        size = os.path.getsize(temp_file)
+        _move_into_place(temp_file, file_hash)
+        return file_hash, codec[0], size
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+def store_chunked(input_file, codec=('none', None), length=None, algorithm='sha512', limiter=None):
+    # splits the file into content-defined chunks and stores every chunk as an own blob.
+    # returns (key of the whole content, [(chunk-key, codec-name, stored-size)]) with the chunks of store()
+    remaining = os.path.getsize(input_file) if length is None else length
+    file_hash = new_hash(algorithm)
+    chunks = []
+    with _open_input(input_file) as f_in:
+        for data in chunking.split(f_in, remaining, settings.CHUNK_MIN_SIZE, settings.CHUNK_AVG_SIZE, settings.CHUNK_MAX_SIZE):
+            helpers.throttle(limiter, len(data))
+            file_hash.update(data)
+            chunks.append(_store_data(data, codec, algorithm))
+    return make_key(algorithm, file_hash.hexdigest()), chunks
+
+def iter_content(blobs):
+    # yields the original content of [(key, codec-name)] in blocks, the chunks of a file one after the other
+    for file_hash, codec in blobs:
+        with read_blob(file_hash, codec) as f_in:
+            while True:
+                data = f_in.read(settings.BACKUP_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+
+def copy_chunks(chunks, output_file, limiter=None):
+    # reassembles a chunked file from [(chunk-key, codec-name)] and returns (strategy, size) like copy_blob()
+    with open(output_file, 'wb') as f_out:
+        for file_hash, codec in chunks:
+            with read_blob(file_hash, codec) as f_in:
+                _copy_stream(f_in, f_out, limiter)
+        return 'chunks', f_out.tell()
+
+def rekey(file_hash, codec, algorithm):
+    # stores a blob again under the key of another hash-algorithm. the content is hashed from the stream of
+    # read_blob(), the stored bytes keep their codec and are taken over as they are.
+    # returns like store() and the size of the content: (key, codec-name, stored-size, size)
+    new_file_hash = new_hash(algorithm)
+    buffer = bytearray(settings.BACKUP_CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = 0
+    with read_blob(file_hash, codec) as f_in:
+        while True:
+            length = f_in.readinto(buffer)
+            if not length:
+                break
+            new_file_hash.update(view[:length])
+            size += length
+    new_file_hash = make_key(algorithm, new_file_hash.hexdigest())
+    if exists(new_file_hash):
+        return new_file_hash, None, None, size
+
+    with open_blob(file_hash) as f_blob:
+        if isinstance(f_blob, io.BytesIO):  # a packed blob stays packed
+            data = f_blob.getvalue()
+            _append_to_pack(new_file_hash, data)
+            return new_file_hash, codec, len(data), size
+        temp_file = os.path.join(settings.INCREMENTAL_PATH, f'.{helpers.rnd(12)}.tmp')
+        try:
+            with open(temp_file, 'wb') as f_out:
+                _copy_file(f_blob, f_out)
+            stored_size = os.path.getsize(temp_file)
+            _move_into_place(temp_file, new_file_hash)
+            return new_file_hash, codec, stored_size, size
+        except Exception:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+def rekey_chunks(chunks, algorithm):
+    # like rekey() for a chunked file of [(chunk-key, codec-name)], the chunks keep their bounds.
+    # returns like store_chunked() and the size of the content: (key, [(chunk-key, codec-name, stored-size)], size)
+    file_hash = new_hash(algorithm)
+    size = 0
+    for data in iter_content(chunks):
+        file_hash.update(data)
+        size += len(data)
+    return make_key(algorithm, file_hash.hexdigest()), [rekey(chunk_hash, codec, algorithm)[:3] for chunk_hash, codec in chunks], size
+
+def remove(hashes):  # 261x
+    removed = 0
+    packed = []
+    try:
+        for file_hash in hashes:
+            # the fan-out path is tried again in case a running migration just moved the blob
+            for path in [blob_path(file_hash), os.path.join(settings.INCREMENTAL_PATH, file_hash), blob_path(file_hash)]:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            _remove_empty_dirs(os.path.dirname(blob_path(file_hash)))
+            if _find_packed(file_hash) is not None:
+                packed.append(file_hash)
+        if len(packed) > 0:
+            removed += _remove_packed(packed)
+        return removed, 0
+    except Exception as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2611
+
+def sweep(referenced, min_age):  # 264x
+    # removes the blobs which no backup references, left behind by a create or import that failed or crashed,
+    # and their temp-files. blobs and packs written within min_age seconds are kept, they can belong to a
+    # backup that is written right now. referenced: the keys of all backups
+    deadline = time.time() - min_age
+    states = {
+        'removed': 0,
+        'temp-files': 0,
+        'recent': 0
+    }
+    try:
+        orphaned = []
+        for root, dirs, files in os.walk(settings.INCREMENTAL_PATH):
+            if root == settings.INCREMENTAL_PATH:
+                dirs[:] = [name for name in dirs if name != PACKS_DIR]
+            for file in files:
+                file_path = os.path.join(root, file)
+                try:
+                    modified = os.stat(file_path).st_mtime
+                    if file.startswith('.'):
+                        if file.endswith('.tmp') and modified < deadline:
+                            os.remove(file_path)
+                            states['temp-files'] += 1
+                    elif file not in referenced:
+                        if modified < deadline:
+                            orphaned.append(file)
+                        else:
+                            states['recent'] += 1
+                except FileNotFoundError:
+                    pass
+        with _locked_packs():
+            _load_pack_index()
+            for file_hash, entry in [*_pack_index.items()]:
+                if file_hash in referenced:
+                    continue
+                if os.stat(os.path.join(_packs_path(), entry[0])).st_mtime < deadline:
+                    orphaned.append(file_hash)
+                else:
+                    states['recent'] += 1
+            result = remove(orphaned)
+        if result[1] > 0:
+            return 'cannot remove unreferenced blobs', 2641, result
+        states['removed'] = result[0]
+        return states, 0
+    except Exception as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2642
+
+def migrate():  # 262x
+    # moves blobs of the flat layout into the fan-out layout. a rename is atomic, so create, restore and
+    # remove keep working while this runs
+    if not _migration_lock.acquire(blocking=False):
+        return 'migration is already running', 2621
+    try:
+        states = {
+            'migrated': 0,
+            'duplicates': 0,
+            'packed': 0
+        }
+        with os.scandir(settings.INCREMENTAL_PATH) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    if os.path.exists(blob_path(entry.name)) or _find_packed(entry.name) is not None:
+                        os.remove(entry.path)
+                        states['duplicates'] += 1
+                    elif entry.stat().st_size < settings.PACK_THRESHOLD:
+                        _pack_loose_blob(entry.path, entry.name)
+                        states['packed'] += 1
+                    else:
+                        _move_into_place(entry.path, entry.name)
+                        states['migrated'] += 1
+                except FileNotFoundError:
+                    pass  # removed by a concurrent backup-remove
+
+        # small blobs written before packs existed
+        for root, _, files in os.walk(settings.INCREMENTAL_PATH):
+            if root == settings.INCREMENTAL_PATH or os.path.basename(root) == PACKS_DIR:
+                continue
+            for file in files:
+                file_path = os.path.join(root, file)
+                try:
+                    if file.startswith('.') or os.path.getsize(file_path) >= settings.PACK_THRESHOLD:
+                        continue
+                    if _find_packed(file) is not None:
+                        os.remove(file_path)
+                        states['duplicates'] += 1
+                    else:
+                        _pack_loose_blob(file_path, file)
+                        states['packed'] += 1
+                except FileNotFoundError:
+                    pass
+        helpers.write_json(os.path.join(settings.INCREMENTAL_PATH, MIGRATED_FILE), states)
+        return states, 0
+    except Exception as e:
+        logging.error(f"unexpected error: {e}")
+        return str(e), 2622
+    finally:
+        _migration_lock.release()
+
+def start_migration(skip_migrated=False):  # 263x
+    # skip_migrated: nothing is started, if a migration finished before. blobs are written in the fan-out
+    # layout and packs since then, so only a store of an older version needs it
+    if skip_migrated and os.path.exists(os.path.join(settings.INCREMENTAL_PATH, MIGRATED_FILE)):
+        return {
+            'state': 'already migrated'
+        }, 0
+    if _migration_lock.locked():
+        return {
+            'state': 'already running'
+        }, 0
+    thread = threading.Thread(target=migrate, name='storage-migration', daemon=True)
+    thread.start()
+    return {
+        'state': 'started'
+    }, 0
+
+def _copy_file(f_in, f_out, limiter=None):
+    # reflink (shares the extents copy-on-write), copy_file_range (copies inside the kernel) or a plain copy.
+    # a reflink writes no data, so it is not throttled
+    try:
+        fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+        return 'reflink'
+    except OSError:
+        pass
+    try:
+        size = os.fstat(f_in.fileno()).st_size
+        offset = 0
+        while offset < size:
+            length = min(size - offset, settings.BACKUP_CHUNK_SIZE)
+            helpers.throttle(limiter, length)
+            copied = os.copy_file_range(f_in.fileno(), f_out.fileno(), length, offset, offset)
+            if copied == 0:
+                break
+            offset += copied
+        return 'copy-range'
+    except (AttributeError, OSError):
+        f_out.truncate(0)  # copy_file_range is not supported between these filesystems
+    _copy_stream(f_in, f_out, limiter)
+    return 'copy'
+
+def _copy_stream(f_in, f_out, limiter=None):
+    buffer = bytearray(settings.BACKUP_CHUNK_SIZE)
+    view = memoryview(buffer)
+    while True:
+        length = f_in.readinto(buffer)
+        if not length:
+            break
+        helpers.throttle(limiter, length)
+        f_out.write(view[:length])
+
+def _move_into_place(file_path, file_hash):
+    # a remove can delete the directory, once it became empty, between makedirs and replace
+    target = blob_path(file_hash)
+    for attempt in range(2):
+        os.makedirs(os.path.dirname(target), mode=0o777, exist_ok=True)
+        try:
+            os.replace(file_path, target)
+            return
+        except FileNotFoundError:
+            if attempt > 0 or not os.path.exists(file_path):
+                raise
+
+def _remove_empty_dirs(directory):
+    # the fan-out directories ab/cd/ of removed blobs. a directory which is not empty stays
+    for path in [directory, os.path.dirname(directory)]:
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+
+def _open_input(input_file):
+    # a given file-object stays open, it belongs to the caller
+    if hasattr(input_file, 'read'):
+        return contextlib.nullcontext(input_file)
+    return open(input_file, 'rb')
+
+def _store_data(data, codec, algorithm):
+    # small blobs and chunks are appended to a pack-file instead of getting an own inode
+    file_hash = new_hash(algorithm)
+    file_hash.update(data)
+    file_hash = make_key(algorithm, file_hash.hexdigest())
+    if exists(file_hash):
+        return file_hash, None, None
+    codec = compression.select(codec, data)
+    data = compression.compress(codec, data)
+    with _locked_packs():  # checked again, another thread or process can have stored it while compressing
+        if exists(file_hash):
+            return file_hash, None, None
+        _append_to_pack(file_hash, data)
+    return file_hash, codec[0], len(data)
+
+def _pack_loose_blob(file_path, file_hash):
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    _append_to_pack(file_hash, data)
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        _remove_packed([file_hash])  # the blob was removed meanwhile
+
+def _packs_path():
+    return os.path.join(settings.INCREMENTAL_PATH, PACKS_DIR)
+
+@contextlib.contextmanager
+def _locked_packs():
+    # threads of this process and other processes (backup-all-server) append to the same packs.
+    # the file-lock is only taken by the outermost call, a second flock() of the same process would block
+    global _pack_lock_depth
+    with _pack_lock:
+        if _pack_lock_depth > 0:
+            _pack_lock_depth += 1
+            try:
+                yield
+            finally:
+                _pack_lock_depth -= 1
+            return
+        os.makedirs(_packs_path(), mode=0o777, exist_ok=True)
+        with open(os.path.join(_packs_path(), '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            _pack_lock_depth = 1
+            try:
+                yield
+            finally:
+                _pack_lock_depth = 0
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _append_to_pack(file_hash, data):
+    # the index-line is written after the data, so a reader never sees an index-entry without its data
+    with _locked_packs():
+        _load_pack_index()
+        packs = sorted(name for name in os.listdir(_packs_path()) if name.endswith('.pack'))
+        if len(packs) == 0 or os.path.getsize(os.path.join(_packs_path(), packs[-1])) + len(data) > settings.PACK_MAX_SIZE:
+            pack_name = _new_pack_name(packs)
+        else:
+            pack_name = packs[-1]
+        with open(os.path.join(_packs_path(), pack_name), 'ab') as pack_file:
+            offset = pack_file.tell()
+            pack_file.write(data)
+        with open(os.path.join(_packs_path(), pack_name[:-5] + '.idx'), 'a') as idx_file:
+            idx_file.write(f'{file_hash} {offset} {len(data)}\n')
+        _load_pack_index()
+
+def _new_pack_name(packs):
+    # pack-numbers only increase, also over removed packs. a reused name could be read through a stale
+    # mapping of another process
+    sequence_file = os.path.join(_packs_path(), PACK_SEQUENCE_FILE)
+    try:
+        with open(sequence_file, 'r') as file:
+            number = int(file.read())
+    except (FileNotFoundError, ValueError):
+        number = 0
+    number = max([number] + [int(pack_name[5:-5]) for pack_name in packs]) + 1
+    temp_file = f'{sequence_file}.{helpers.rnd(6)}.tmp'
+    with open(temp_file, 'w') as file:
+        file.write(str(number))
+    os.replace(temp_file, sequence_file)
+    return f'pack-{number:08d}.pack'
+
+def _remove_packed(hashes):
+    # removed blobs get a tombstone in the index, packs are rewritten once most of them is unused
+    removed = 0
+    with _locked_packs():
+        _load_pack_index()
+        for file_hash in hashes:
+            entry = _pack_index.get(file_hash)
+            if entry is None:
+                continue
+            with open(os.path.join(_packs_path(), entry[0][:-5] + '.idx'), 'a') as idx_file:
+                idx_file.write(f'{file_hash} - -\n')
+            removed += 1
+        _load_pack_index()
+        _compact_packs()
+    return removed
+
+def _compact_packs():
+    packs = sorted(name for name in os.listdir(_packs_path()) if name.endswith('.pack'))
+    live = {pack_name: [] for pack_name in packs}
+    for file_hash, entry in _pack_index.items():
+        live.setdefault(entry[0], []).append(file_hash)
+    for pack_name in packs:
+        pack_file = os.path.join(_packs_path(), pack_name)
+        live_bytes = sum(_pack_index[file_hash][2] for file_hash in live[pack_name])
+        if len(live[pack_name]) > 0 and (pack_name == packs[-1] or live_bytes * 2 >= os.path.getsize(pack_file)):
+            continue
+        for file_hash in live[pack_name]:
+            data = _read_packed(_pack_index[file_hash])
+            del _pack_index[file_hash]
+            _append_to_pack(file_hash, data)
+        os.remove(pack_file[:-5] + '.idx')
+        os.remove(pack_file)
+        _load_pack_index()
+
+def _find_packed(file_hash, reload=False):
+    with _pack_lock:
+        if reload or file_hash not in _pack_index:
+            _load_pack_index(reload)
+        return _pack_index.get(file_hash)
+
+def _load_pack_index(reload=False):
+    # the index-files are append-only, so only the bytes written since the last load are parsed
+    with _pack_lock:
+        if reload:
+            _pack_index.clear()
+            _pack_files.clear()
+        idx_names = {name for name in os.listdir(_packs_path()) if name.endswith('.idx')} if os.path.exists(_packs_path()) else set()
+        for idx_name in [name for name in _pack_files if name not in idx_names]:
+            _forget_pack(idx_name)
+        for idx_name in idx_names:
+            try:
+                stat = os.stat(os.path.join(_packs_path(), idx_name))
+                inode, position = _pack_files.get(idx_name, (stat.st_ino, 0))
+                if inode != stat.st_ino or stat.st_size < position:
+                    _forget_pack(idx_name)
+                    position = 0
+                if stat.st_size > position:
+                    with open(os.path.join(_packs_path(), idx_name), 'rb') as idx_file:
+                        idx_file.seek(position)
+                        data = idx_file.read()
+                    data = data[:data.rfind(b'\n') + 1]  # a line can be half written by another process
+                    pack_name = idx_name[:-4] + '.pack'
+                    for line in data.decode().splitlines():
+                        file_hash, offset, length = line.split(' ')
+                        if offset == '-':
+                            if _pack_index.get(file_hash, ('',))[0] == pack_name:
+                                del _pack_index[file_hash]
+                        else:
+                            _pack_index[file_hash] = (pack_name, int(offset), int(length))
+                    position += len(data)
+                _pack_files[idx_name] = (stat.st_ino, position)
+            except FileNotFoundError:
+                _forget_pack(idx_name)
+
+def _forget_pack(idx_name):
+    pack_name = idx_name[:-4] + '.pack'
+    for file_hash in [file_hash for file_hash, entry in _pack_index.items() if entry[0] == pack_name]:
+        del _pack_index[file_hash]
+    _pack_files.pop(idx_name, None)
+    if pack_name in _pack_maps:
+        _pack_maps.pop(pack_name)[2].close()
+
+def _read_packed(entry):
+    # packs are mapped once per process, a blob is a slice of the mapping
+    pack_name, offset, length = entry
+    with _pack_lock:
+        stat = os.stat(os.path.join(_packs_path(), pack_name))
+        cached = _pack_maps.get(pack_name)
+        if cached is None or cached[0] != stat.st_ino or cached[1] < offset + length:
+            with open(os.path.join(_packs_path(), pack_name), 'rb') as pack_file:
+                pack_map = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if cached is not None:
+                cached[2].close()
+            _pack_maps[pack_name] = (stat.st_ino, stat.st_size, pack_map)
+        return _pack_maps[pack_name][2][offset:offset + length]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# benchmark_parse_log.py
+
+"""
+parses a synthetic server-log of some hundred MB with server.parse_log and reports the throughput.
+python benchmark_parse_log.py --size-mb 300 --min-mb-per-second 30
+exits with 1, if the throughput is below --min-mb-per-second. test_server.py and the build-workflow run it
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
+
+import helpers
+import server
+import settings
+
+NOISE = [
+    'Running AutoCompaction...',
+    'Player Spawned: Steve xuid: 2535400000000001, pfid: 1234567890abcdef',
+    'Opening level \'worlds/Bedrock level/db\'',
+    'IPv4 supported, port: 19132: Used for gameplay and LAN discovery'
+]
+
+def write_log(log_file, size):
+    # one block of lines is repeated with new timestamps, every block connects and disconnects a player
+    lines = []
+    for second in range(60):
+        for message in NOISE:
+            lines.append(f'[2024-01-01 10:{{minute:02d}}:{second:02d}:{second * 7 % 1000:03d} INFO] {message}\n')
+        if second == 10:
+            lines.append(f'[2024-01-01 10:{{minute:02d}}:{second:02d}:000 INFO] Player connected: Steve, xuid: 2535400000000001\n')
+        if second == 50:
+            lines.append(f'[2024-01-01 10:{{minute:02d}}:{second:02d}:000 INFO] Player disconnected: Steve, xuid: 2535400000000001\n')
+    block = ''.join(lines)
+    with open(log_file, 'w') as file:
+        file.write('[2024-01-01 09:59:59:000 INFO] Starting Server\n')
+        file.write('[2024-01-01 09:59:59:000 INFO] Level Name: Bedrock level\n')
+        file.write('[2024-01-01 09:59:59:500 INFO] Server started.\n')
+        written = 0
+        minute = 0
+        while written < size:
+            data = block.replace('{minute:02d}', f'{minute % 60:02d}')
+            file.write(data)
+            written += len(data)
+            minute += 1
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of server.parse_log')
+    parser.add_argument('--size-mb', type=int, default=300, help='size of the synthetic log')
+    parser.add_argument('--min-mb-per-second', type=float, default=30, help='fails below this throughput, 0 never fails')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    settings.LOGS_PATH = os.path.join(root, 'logs')
+    settings.SERVER_PATH = os.path.join(root, 'server')  # player.json of the synthetic players
+    os.mkdir(settings.LOGS_PATH)
+    os.mkdir(settings.SERVER_PATH)
+    try:
+        log_file = os.path.join(settings.LOGS_PATH, 'benchmark')
+        write_log(log_file, args.size_mb * 1024 * 1024)
+        size = os.path.getsize(log_file)
+
+        start_time = time.perf_counter()
+        result = server.parse_log('benchmark')
+        full_time = time.perf_counter() - start_time
+        assert result[1] == 0, result
+        assert result[0]['state'] == 'disconnected', result[0]['state']
+
+        with open(log_file, 'a') as file:
+            file.write('[2024-01-01 11:00:00:000 INFO] Server stop requested.\n')
+        start_time = time.perf_counter()
+        result = server.parse_log('benchmark')
+        tail_time = time.perf_counter() - start_time
+        assert result[0]['state'] == 'stopped', result[0]['state']
+
+        with open(log_file, 'a') as file:
+            file.write('[2024-01-01 11:01:00:000 INFO] Starting Server\n')
+            file.write('[2024-01-01 11:01:01:000 INFO] Level Name: Restarted level\n')
+        server._log_tails.clear()  # like a new process
+        start_time = time.perf_counter()
+        result = server.parse_log('benchmark')
+        session_time = time.perf_counter() - start_time
+        assert result[0]['level-name'] == 'Restarted level', result[0]
+
+        mb_per_second = size / 1024 / 1024 / full_time
+        print(f'full parse: {size / 1024 / 1024:.0f} MB in {full_time:.2f} s, {mb_per_second:.1f} MB/s')
+        print(f'parse of one new line: {tail_time * 1000:.2f} ms')
+        print(f'new process, parse of the last session: {session_time * 1000:.2f} ms')
+        if mb_per_second < args.min_mb_per_second:
+            print(f'slower than {args.min_mb_per_second} MB/s')
+            sys.exit(1)
+    finally:
+        helpers.remove_dirtree(root)
+
+if __name__ == '__main__':
+    main()
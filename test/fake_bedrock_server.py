@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# fake_bedrock_server.py
+
+"""
+answers the console-commands of a bedrock_server, that are needed by the tests:
+save hold, save query, save resume and stop.
+copy it as bedrock_server into a server-directory with a server.properties and a world.
+"""
+
+import os
+import sys
+from datetime import datetime
+
+QUERIES_UNTIL_READY = 2  # the first save query after save hold is not ready, like on a busy server
+
+def log(message):
+    now = datetime.now()
+    print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}:{now.microsecond // 1000:03d} INFO] {message}", flush=True)
+
+def read_level_name():
+    with open('server.properties', 'r') as file:
+        for line in file:
+            if line.startswith('level-name='):
+                return line.strip().split('=', 1)[1]
+    return 'Bedrock level'
+
+def list_world(level_name):
+    world_path = os.path.join('worlds', level_name)
+    files = []
+    for root, _, file_names in os.walk(world_path):
+        for file_name in sorted(file_names):
+            path = os.path.join(root, file_name)
+            files.append((os.path.relpath(path, 'worlds'), os.path.getsize(path)))
+    return files
+
+def main():
+    level_name = read_level_name()
+    log('Starting Server')
+    log('Version: 0.0.0.0')
+    log(f'Level Name: {level_name}')
+    log('Game mode: 0 Survival')
+    log('Difficulty: 1 EASY')
+    log('Server started.')
+
+    queries = None
+    for line in sys.stdin:
+        command = line.strip()
+        if command == 'save hold':
+            queries = 0
+            print('Saving...', flush=True)
+        elif command == 'save query':
+            if queries is None or queries + 1 < QUERIES_UNTIL_READY:
+                if queries is not None:
+                    queries += 1
+                print('A previous save has not been completed.', flush=True)
+                continue
+            files = list_world(level_name)
+            print('Data saved. Files are now ready to be copied.', flush=True)
+            print(', '.join(f'{path}:{size}' for path, size in files), flush=True)
+            # the server keeps writing behind the reported lengths
+            for path, _ in files:
+                if path.endswith('.log'):
+                    with open(os.path.join('worlds', path), 'ab') as file:
+                        file.write(b'written after save query')
+        elif command == 'save resume':
+            queries = None
+            print('Changes to the level are resumed.', flush=True)
+        elif command == 'stop':
+            log('Server stop requested.')
+            print('Quit correctly', flush=True)
+            break
+
+if __name__ == '__main__':
+    main()
@@ -5,18 +5,31 @@ pip install pytest;
 pytest -s ../test
 """
 
+import concurrent.futures
+import gzip
+import hashlib
+import io
 import sys
 import os
 import pytest
 import re
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../app')))
 
 import settings
 import helpers
+import player
 import server
 import backup
+import catalog
 import world
+import compression
+import storage
 
 rnd = '_' + helpers.rnd(3)
 ctx = {}
@@ -28,6 +41,7 @@ def prepare():
     settings.LOGS_PATH += rnd
     settings.BACKUPS_PATH += rnd
     settings.INCREMENTAL_PATH += rnd
+    settings.HASH_CACHE_PATH += rnd
     
     os.mkdir(settings.DOWNLOADED_PATH)
     os.chmod(settings.DOWNLOADED_PATH, 0o777)
@@ -39,6 +53,8 @@ def prepare():
     os.chmod(settings.BACKUPS_PATH, 0o777)
     os.mkdir(settings.INCREMENTAL_PATH)
     os.chmod(settings.INCREMENTAL_PATH, 0o777)
+    os.mkdir(settings.HASH_CACHE_PATH)
+    os.chmod(settings.HASH_CACHE_PATH, 0o777)
 
     yield True
     server.stop_all()
@@ -47,6 +63,7 @@ def prepare():
     helpers.remove_dirtree(settings.LOGS_PATH)
     helpers.remove_dirtree(settings.BACKUPS_PATH)
     helpers.remove_dirtree(settings.INCREMENTAL_PATH)
+    helpers.remove_dirtree(settings.HASH_CACHE_PATH)
 
 def test_get_online_stable_version():
     result = server.get_online_version()
@@ -416,6 +433,132 @@ def test_parse_log():
     assert 'state' in result[0]
     assert 'stop-time' not in result[0]
 
+def test_parse_log_incremental():
+    log_file = os.path.join(settings.LOGS_PATH, 'log-server')
+    with open(log_file, 'w') as file:
+        file.write('[2024-01-01 10:00:00:000 INFO] Starting Server\n')
+        file.write('[2024-01-01 10:00:01:000 INFO] Level Name: level-1\n')
+        file.write('[2024-01-01 10:00:02:000 INFO] Server sta')  # not completely written yet
+    result = server.parse_log('log-server')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['state'] == 'starting'
+    assert result[0]['level-name'] == 'level-1'
+
+    with open(log_file, 'a') as file:
+        file.write('rted.\n')
+        file.write('Saving...\n')  # the answer of save hold has no timestamp
+    result = server.parse_log('log-server')
+    assert result[1] == 0
+    assert result[0]['state'] == 'started'
+    assert result[0]['started-time'] == '2024-01-01 10:00:02'
+    assert result[0]['save-state'] == 'holding'
+
+    os.remove(log_file)  # like start_simple
+    result = server.parse_log('log-server')
+    assert result[1] == 1202
+    with open(log_file, 'w') as file:
+        file.write('[2024-01-02 10:00:00:000 INFO] Starting Server\n')
+    result = server.parse_log('log-server')
+    assert result[1] == 0
+    assert result[0]['state'] == 'starting'
+    assert 'level-name' not in result[0]
+    os.remove(log_file)
+
+def test_parse_log_player_events():
+    log_file = os.path.join(settings.LOGS_PATH, 'log-server')
+    with open(log_file, 'w') as file:
+        file.write('[2024-01-01 10:00:00:000 INFO] Starting Server\n')
+        file.write('[2024-01-01 10:01:00:000 INFO] Player connected: log_player, xuid: 2535400000000001\n')
+        file.write('[2024-01-01 10:03:00:000 INFO] Player disconnected: log_player, xuid: 2535400000000001\n')
+    result = server.parse_log('log-server')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['user-count'] == 0
+
+    def known():
+        return [known for known in player.get_known()[0]['players'] if known['name'] == 'log_player']
+    assert len(known()) == 1
+    assert known()[0]['playtime'] == 120
+
+    server._log_tails.clear()  # like another process, the events are counted already
+    result = server.parse_log('log-server')
+    assert result[1] == 0
+    assert known()[0]['playtime'] == 120
+    os.remove(log_file)
+
+def test_parse_log_player_events_sessions():
+    log_file = os.path.join(settings.LOGS_PATH, 'log-server')
+    with open(log_file, 'w') as file:
+        file.write('[2024-01-02 10:00:00:000 INFO] Starting Server\n')
+        file.write('[2024-01-02 10:01:00:000 INFO] Player connected: log_player_2, xuid: 2535400000000002\n')
+        file.write('[2024-01-02 10:02:00:000 INFO] Player disconnected: log_player_2, xuid: 2535400000000002\n')
+        file.write('[2024-01-02 10:10:00:000 INFO] Starting Server\n')
+        file.write('[2024-01-02 10:11:00:000 INFO] Player connected: log_player_3, xuid: 2535400000000003\n')
+    result = server.parse_log('log-server')
+    assert result[1] == 0
+    assert result[0]['user-count'] == 1
+
+    def known(name):
+        return [known for known in player.get_known()[0]['players'] if known['name'] == name][0]
+    assert known('log_player_2')['playtime'] == 60
+    assert known('log_player_3')['playtime'] == 0
+
+    # the mark is behind the connect, the disconnect and a restart come in front of the next process
+    with open(log_file, 'a') as file:
+        file.write('[2024-01-02 10:14:00:000 INFO] Player disconnected: log_player_3, xuid: 2535400000000003\n')
+        file.write('[2024-01-02 10:20:00:000 INFO] Starting Server\n')
+        file.write('[2024-01-02 10:20:01:000 INFO] Level Name: restarted\n')
+    server._log_tails.clear()
+    result = server.parse_log('log-server')
+    assert result[1] == 0
+    assert result[0]['level-name'] == 'restarted'
+    assert result[0].get('user-count', 0) == 0
+    assert known('log_player_2')['playtime'] == 60
+    assert known('log_player_3')['playtime'] == 180
+    os.remove(log_file)
+
+def test_benchmark_parse_log():
+    # own process, the benchmark changes the paths of the settings
+    result = subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), 'benchmark_parse_log.py'), '--size-mb', '50'], capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+def test_wait_for_change():
+    log_file = os.path.join(settings.LOGS_PATH, 'watched-log')
+    with helpers.watch_file(log_file) as watch:
+        assert watch['fd'] is not None  # inotify
+        assert helpers.wait_for_change(watch, 0.2) == False  # timeout
+
+        with open(os.path.join(settings.LOGS_PATH, 'other-log'), 'a') as file:
+            file.write('other\n')
+        assert helpers.wait_for_change(watch, 0.2) == False  # only the watched file counts
+
+        with open(log_file, 'a') as file:
+            file.write('created\n')
+        assert helpers.wait_for_change(watch, 5) == True
+        with open(log_file, 'a') as file:
+            file.write('appended\n')
+        assert helpers.wait_for_change(watch, 5) == True
+
+        watch['fd'], fd = None, watch['fd']  # without inotify it sleeps one poll_interval
+        start_time = time.monotonic()
+        assert helpers.wait_for_change(watch, 5, 0.1) == True
+        assert time.monotonic() - start_time < 1
+        watch['fd'] = fd
+    os.remove(log_file)
+    os.remove(os.path.join(settings.LOGS_PATH, 'other-log'))
+
+def test_wait_for_exit():
+    process = subprocess.Popen(['sleep', '0.2'])
+    assert helpers.wait_for_exit(process.pid, 5) == True
+    process.wait()
+
+    process = subprocess.Popen(['sleep', '5'])
+    assert helpers.wait_for_exit(process.pid, 0.2) == False  # timeout
+    process.kill()
+    process.wait()
+    assert helpers.wait_for_exit(process.pid, 0.2) == True  # not exists anymore
+
 def test_get_worlds():
     result = world.list()
     assert isinstance(result, tuple)
@@ -583,14 +726,108 @@ def test_create_backup():
     assert "backup-name" in result[0]
     assert isinstance(result[0]["backup-name"], str)
     assert result[0]["backup-name"] == 'backup-1'
+    assert "file-count" in result[0]
+    assert result[0]["file-count"] > 0
 
     result = backup.create('test-server-1', None, 'backup-1')  # with current world
     assert isinstance(result, tuple)
     assert result[1] == 2015  # backup already exists
 
+    result = backup.create('test-server-1', 'level-1', 'backup-1', True, None, 'blubb')
+    assert isinstance(result, tuple)
+    assert result[1] == 2019  # unknown codec
+
+    result = backup.create('test-server-1', 'level-1', 'backup-1', True, None, 'gzip:19')
+    assert isinstance(result, tuple)
+    assert result[1] == 2019
+    assert result[2][1] == 2712  # invalid level of gzip
+
+    result = backup.create('test-server-1', 'level-1', 'backup-1', True, None, 'auto:30')
+    assert isinstance(result, tuple)
+    assert result[1] == 2019
+    assert result[2][1] == 2712  # invalid level of the codec auto falls back to
+
     result = backup.create('test-server-1', 'level-1', 'backup-1', True)  # overwrite
     assert isinstance(result, tuple)
     assert result[1] == 0
+    assert "cached-count" in result[0]
+    assert result[0]["cached-count"] <= result[0]["file-count"]
+
+    result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, 'backup-1.properties'))
+    assert result[1] == 0
+    assert result[0]['manifest-version'] == '4'
+    assert result[0]['hash-algorithm'] == settings.HASH_ALGORITHM
+    assert all(value.split('|')[1] in ['none', 'gzip'] for key, value in result[0].items() if key.startswith('file.'))
+
+    result = backup.create('test-server-1', 'level-1', 'backup-1', True, None, 'auto')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+
+def test_hash_cache():
+    world_path = os.path.join(settings.SERVER_PATH, 'test-server-1', 'worlds', 'level-1')
+    changed_file = os.path.join(world_path, 'hash-cache.txt')
+    with open(changed_file, 'w') as file:
+        file.write('first')
+    hour_ago = time.time() - 3600
+    for root, _, file_names in os.walk(world_path):  # older than the racy window, so their hashes are cached
+        for file_name in file_names:
+            os.utime(os.path.join(root, file_name), (hour_ago, hour_ago))
+
+    result = backup.create('test-server-1', 'level-1', 'hash-cache-backup')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    result = backup.create('test-server-1', 'level-1', 'hash-cache-backup', True)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['cached-count'] == result[0]['file-count']  # nothing hashed again
+
+    with open(changed_file, 'w') as file:
+        file.write('second')
+    os.utime(changed_file, (hour_ago + 60, hour_ago + 60))
+    result = backup.create('test-server-1', 'level-1', 'hash-cache-backup', True)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['cached-count'] == result[0]['file-count'] - 1  # the changed file is hashed again
+    result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, 'hash-cache-backup.properties'))
+    entries = [value.split('|') for key, value in result[0].items() if key.startswith('file.')]
+    assert [entry[0] for entry in entries if entry[-1] == 'hash-cache.txt'] == [storage.hash_file(changed_file, settings.HASH_ALGORITHM)]
+
+    assert backup.remove('hash-cache-backup')[1] == 0
+    os.remove(changed_file)
+
+def test_detect_codec():
+    for name in compression.CODECS:
+        data = (name * 1000).encode()
+        file_hash, codec, stored_size = storage.store(io.BytesIO(data), (name, compression.CODECS[name]['level']), len(data), 'sha256')
+        assert codec == name
+        assert storage.detect_codec(file_hash) == name
+        storage.remove([file_hash])
+
+    result = compression.parse('lzma:9')
+    assert result == (('lzma', 9), 0)
+    result = compression.parse('none:1')
+    assert result[1] == 2712  # no levels
+
+def test_pack_names():
+    def packs():
+        return sorted(name for name in os.listdir(os.path.join(settings.INCREMENTAL_PATH, 'packs')) if name.endswith('.pack'))
+
+    pack_max_size = settings.PACK_MAX_SIZE
+    settings.PACK_MAX_SIZE = 1  # every blob gets an own pack
+    file_hash = storage.store(io.BytesIO(b'packed once'), ('none', None), len(b'packed once'))[0]
+    last_pack = packs()[-1]
+    storage.remove([file_hash])
+    assert last_pack not in packs()  # compacted
+    file_hash = storage.store(io.BytesIO(b'packed twice'), ('none', None), len(b'packed twice'))[0]
+    assert packs()[-1] > last_pack  # the name of a removed pack is not used again
+    storage.remove([file_hash])
+    settings.PACK_MAX_SIZE = pack_max_size
+
+    data = os.urandom(256) * 60
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = [*executor.map(lambda _: storage.store(io.BytesIO(data), ('gzip', 9), len(data)), range(8))]
+    assert len([result for result in results if result[1] is not None]) == 1  # appended once
+    storage.remove([results[0][0]])
 
 def test_list_backups():
     result = backup.list()
@@ -607,6 +844,227 @@ def test_list_backups():
     assert "backup-name" in result[0]['backup-1']
     assert isinstance(result[0]['backup-1']["backup-name"], str)
     assert result[0]['backup-1']["backup-name"] == 'backup-1'
+    assert result[0]['backup-1']["size"] > 0
+    assert result[0]['backup-1']["stored-size"] > 0
+    assert result[0]['backup-1']["unique-size"] == result[0]['backup-1']["stored-size"]  # the only backup
+
+def test_get_backup_summary():
+    result = backup.summary()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['backup-count'] == 1
+    assert result[0]['size'] == backup.list()[0]['backup-1']['size']
+    assert result[0]['stored-size'] == result[0]['unique-size']
+    assert result[0]['shared-size'] == 0
+    assert result[0]['dedup-ratio'] > 0
+
+def test_rebuild_backup_catalog():
+    # blobs of a failed backup, referenced by no backup-file: one loose, one in a pack and a new one
+    loose = storage.store(io.BytesIO(os.urandom(settings.PACK_THRESHOLD)), ('none', None), settings.PACK_THRESHOLD)[0]
+    packed = storage.store(io.BytesIO(b'orphaned'), ('none', None), len(b'orphaned'))[0]
+    day_ago = time.time() - 24 * 3600 - 60
+    os.utime(storage.find(loose), (day_ago, day_ago))
+    loose_dir = os.path.dirname(storage.blob_path(loose))
+    alone = os.listdir(loose_dir) == [loose]  # no other blob in its fan-out directory
+    for pack in os.listdir(os.path.join(settings.INCREMENTAL_PATH, 'packs')):
+        os.utime(os.path.join(settings.INCREMENTAL_PATH, 'packs', pack), (day_ago, day_ago))
+    recent = storage.store(io.BytesIO(os.urandom(settings.PACK_THRESHOLD)), ('none', None), settings.PACK_THRESHOLD)[0]
+
+    result = backup.rebuild_catalog()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['backup-count'] == 1
+    assert result[0]['updated'] == 1
+    assert result[0]['swept']['removed'] >= 2
+    assert not storage.exists(loose)
+    assert not alone or not os.path.exists(loose_dir)  # the empty fan-out directory is removed
+    assert not storage.exists(packed)
+    assert storage.exists(recent)  # could belong to a backup which is written right now
+    storage.remove([recent])
+
+    result = backup.verify(0, None, None, False)
+    assert result[1] == 0
+    assert result[0]['missing'] == 0
+
+    result = backup.list()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert len(result[0]) == 1
+    assert 'backup-1' in result[0]
+    assert result[0]['backup-1']['file-count'] > 0
+
+def test_catalog_of_other_schema():
+    connection = sqlite3.connect(os.path.join(settings.BACKUPS_PATH, catalog.CATALOG_FILE))
+    connection.execute(f'PRAGMA user_version = {catalog.SCHEMA_VERSION + 1}')
+    connection.close()
+
+    result = backup.list()  # dropped and filled again from the backup-files
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert 'backup-1' in result[0]
+    assert result[0]['backup-1']['stored-size'] > 0
+
+def test_invalid_backup_file():
+    helpers.write_properties(os.path.join(settings.BACKUPS_PATH, 'broken-backup.properties'), {
+        'server-name': 'test-server-1', 'level-name': 'level-1', 'manifest-version': 3, 'file.0': 'abc|none|None|1|level.dat'
+    })
+    result = backup.list()  # the other backups are listed
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert 'backup-1' in result[0]
+    assert 'broken-backup' not in result[0]
+
+    result = backup.rebuild_catalog()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['invalid']['broken-backup'][1] == 2133  # invalid backup-file
+
+    result = backup.restore('broken-backup', 'test-server-1', 'level-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 2023  # cannot read backup-details
+
+    result = backup.remove('broken-backup')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+
+def test_migrate_backup_store():
+    result = backup.migrate_store()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert 'migrated' in result[0]
+    assert len([file for file in os.listdir(settings.INCREMENTAL_PATH) if os.path.isfile(os.path.join(settings.INCREMENTAL_PATH, file)) and file != storage.MIGRATED_FILE]) == 0
+    assert len([file for file in os.listdir(os.path.join(settings.INCREMENTAL_PATH, 'packs')) if file.endswith('.pack')]) > 0  # levelname.txt etc.
+
+    result = storage.start_migration(True)  # like the start of the api
+    assert result[1] == 0
+    assert result[0]['state'] == 'already migrated'
+
+def test_verify_backups():
+    result = backup.verify(0, None, 0)  # time-limit reached at once
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['finished'] == False
+
+    result = backup.verify(0)  # continues the pass
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['finished'] == True
+    assert result[0]['blobs-verified'] == result[0]['blobs-total']
+    assert result[0]['corrupt'] == 0
+    assert result[0]['missing'] == 0
+
+def test_prune_backups():
+    result = backup.prune(None, {'yearly': 1})
+    assert isinstance(result, tuple)
+    assert result[1] == 2243  # invalid retention-policy
+
+    result = backup.prune(None, {'last': 0, 'hourly': 0, 'daily': 0, 'weekly': 0, 'monthly': 0})
+    assert isinstance(result, tuple)
+    assert result[1] == 2243  # keeps no backup
+
+    count = len(backup.list()[0])
+    result = backup.prune(None, {'last': 1, 'hourly': 0, 'daily': 0, 'weekly': 0, 'monthly': 0}, True)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['dry-run'] == True
+    assert all(len(names) == 1 for names in result[0]['kept'].values())
+    assert result[0]['reclaimed-bytes'] >= 0
+    assert len(backup.list()[0]) == count  # nothing removed
+
+    result = backup.prune(None, {'last': 1000})
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['pruned'] == []
+    assert len(backup.list()[0]) == count
+
+def test_export_import_backup():
+    result = backup.export_archive('backup-1', 'zip')
+    assert isinstance(result, tuple)
+    assert result[1] == 2262  # unknown archive-format
+
+    for archive_format in ['tar', 'mcworld']:
+        result = backup.export_archive('backup-1', archive_format)
+        assert isinstance(result, tuple)
+        assert result[1] == 0
+        assert result[0]['file-name'] == 'backup-1.' + archive_format
+        archive = io.BytesIO(b''.join(result[0]['content']))
+
+        result = backup.import_archive(archive, archive_format)
+        assert isinstance(result, tuple)
+        assert result[1] == (2276 if archive_format == 'tar' else 2275)  # backup exists / server-name is required
+
+        archive.seek(0)
+        result = backup.import_archive(archive, archive_format, 'imported-' + archive_format, 'test-server-1')
+        assert isinstance(result, tuple)
+        assert result[1] == 0
+        assert result[0]['level-name'] == 'level-1'
+        assert result[0]['file-count'] > 0
+        assert backup.remove('imported-' + archive_format)[1] == 0
+
+    def crafted_tar(members):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            for name, data in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        archive.seek(0)
+        return archive
+
+    injected = b'file.9=' + b'0' * 128 + b'|none|1|1|../../../escaped.txt\nmanifest-version=4\ndescription=crafted\n'
+    result = backup.import_archive(crafted_tar({'backup.properties': injected, 'world/levelname.txt': b'level-1'}), 'tar', 'crafted', 'test-server-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['description'] == 'crafted'
+    result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, 'crafted.properties'))
+    assert all('..' not in value for key, value in result[0].items() if key.startswith('file.'))
+    assert backup.remove('crafted')[1] == 0
+
+    result = backup.import_archive(crafted_tar({'world/../escaped.txt': b'x'}), 'tar', 'crafted', 'test-server-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 2277  # invalid path in archive
+
+    result = backup.import_archive(crafted_tar({'world/levelname.txt': b'level-1'}), 'tar', '../crafted', 'test-server-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 2270  # invalid backup-name
+
+LEGACY_WORLD_FILES = {'levelname.txt': b'legacy-level', 'db/CURRENT': b'MANIFEST-000001\n', 'level.dat': b'level' * 100}
+
+def write_legacy_backup(backup_name):
+    # a backup-file of version 1: <sha512>=<path>, the blobs in the flat layout, gzip or uncompressed
+    properties = {'server-name': 'test-server-1', 'level-name': 'legacy-level', 'backup-name': backup_name, 'datetime': '2024-01-01 10:00', 'description': None, 'version': 'unknown'}
+    for i, (path, data) in enumerate(LEGACY_WORLD_FILES.items()):
+        file_hash = hashlib.sha512(data).hexdigest()
+        properties[file_hash] = path
+        with open(os.path.join(settings.INCREMENTAL_PATH, file_hash), 'wb') as file:
+            file.write(gzip.compress(data) if i % 2 == 0 else data)
+    helpers.write_properties(os.path.join(settings.BACKUPS_PATH, backup_name + '.properties'), properties)
+
+def test_migrate_hash_algorithm():
+    write_legacy_backup('legacy-migrated')
+    settings.HASH_ALGORITHM = 'blake2b'
+    result = backup.migrate_hash_algorithm()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['migrated'] > 0
+    assert len(result[0]['failed']) == 0
+
+    result = backup.list()
+    assert result[1] == 0
+    assert result[0]['legacy-migrated']['size'] == sum(len(data) for data in LEGACY_WORLD_FILES.values())  # sizes of version 1 are known now
+    assert backup.remove('legacy-migrated')[1] == 0
+
+    result = backup.verify(0, None, None, False)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['corrupt'] == 0
+    assert result[0]['missing'] == 0
+
+    result = backup.migrate_hash_algorithm()
+    assert result[1] == 0
+    assert result[0]['migrated'] == 0
+    assert result[0]['skipped'] > 0
+    settings.HASH_ALGORITHM = 'sha512'
 
 def test_remove_world():
     result = world.remove('test-server-1')
@@ -660,6 +1118,29 @@ def test_restore_backup():
     assert isinstance(result[0]["backup-name"], str)
     assert result[0]["backup-name"] == 'backup-1'
 
+def test_restore_legacy_backup():
+    world_files = LEGACY_WORLD_FILES
+    write_legacy_backup('legacy-backup')
+
+    result = backup.restore('legacy-backup', 'test-server-1', 'level-3')  # upgrades the backup-file
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    result = backup.restore('legacy-backup', 'test-server-1', 'level-3')  # every file is skipped
+    assert result[1] == 0
+    assert result[0]['files-skipped'] == len(world_files)
+
+    result = backup.list()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['legacy-backup']['size'] == sum(len(data) for data in world_files.values())
+
+    result = backup.remove('legacy-backup')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+
+    result = backup.restore('backup-1', 'test-server-1', 'level-3')
+    assert result[1] == 0
+
 def test_get_worlds_2():
     result = world.list('test-server-2')
     assert isinstance(result, tuple)
@@ -674,6 +1155,132 @@ def test_get_worlds_2():
     assert len(result[0]['worlds']) == 1
     assert 'level-3' in result[0]['worlds']
 
+def test_hot_backup():
+    # a fake bedrock_server answers save hold, save query and save resume
+    server_path = os.path.join(settings.SERVER_PATH, 'fake-server')
+    world_path = os.path.join(server_path, 'worlds', 'level-1')
+    os.makedirs(os.path.join(world_path, 'db'))
+    helpers.write_properties(os.path.join(server_path, 'server.properties'), {'level-name': 'level-1', 'server-port': '19140'})
+    with open(os.path.join(world_path, 'levelname.txt'), 'w') as file:
+        file.write('level-1')
+    with open(os.path.join(world_path, 'db', '000003.log'), 'wb') as file:
+        file.write(b'x' * 1000)
+    shutil.copy(os.path.join(os.path.dirname(__file__), 'fake_bedrock_server.py'), os.path.join(server_path, 'bedrock_server'))
+    os.chmod(os.path.join(server_path, 'bedrock_server'), 0o777)
+
+    result = server.start_simple('fake-server')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+
+    result = backup.create('fake-server', 'level-1', 'hot-backup-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 2014  # world is in use
+
+    result = backup.create('fake-server', 'level-1', 'hot-backup-1', hot=True)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['hot'] == True
+    assert os.path.getsize(os.path.join(world_path, 'db', '000003.log')) > 1000  # written after save query
+
+    result = server.stop('fake-server')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+
+    result = backup.restore('hot-backup-1', 'fake-server', 'level-2')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert os.path.getsize(os.path.join(server_path, 'worlds', 'level-2', 'db', '000003.log')) == 1000
+    assert result[0]['strategies']['db/000003.log'] in ['reflink', 'copy-range', 'copy']
+
+    with open(os.path.join(server_path, 'worlds', 'level-2', 'db', '000004.log'), 'wb') as file:
+        file.write(b'not in the backup')
+    result = backup.restore('hot-backup-1', 'fake-server', 'level-2')  # differential
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['files-written'] == 0
+    assert result[0]['files-removed'] == 1
+    assert result[0]['bytes-skipped'] >= 1000
+    assert not os.path.exists(os.path.join(server_path, 'worlds', 'level-2', 'db', '000004.log'))
+
+    result = backup.restore_all(['fake-server'], 10 * 1024 * 1024)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['restored'] == {'fake-server/level-1': 'hot-backup-1'}
+    assert len(result[0]['failed']) == 0
+
+    result = backup.restore_all_progress()
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['fake-server/level-1']['state'] == 'restored'
+
+    result = backup.remove('hot-backup-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert server.remove('fake-server')[1] == 0
+
+def test_chunked_backup():
+    server_path = os.path.join(settings.SERVER_PATH, 'chunk-server')
+    world_path = os.path.join(server_path, 'worlds', 'level-1')
+    os.makedirs(os.path.join(world_path, 'db'))
+    helpers.write_properties(os.path.join(server_path, 'server.properties'), {'level-name': 'level-1', 'server-port': '19141'})
+    with open(os.path.join(world_path, 'levelname.txt'), 'w') as file:
+        file.write('level-1')
+    content = os.urandom(4 * settings.CHUNKING_MIN_FILE_SIZE)
+    with open(os.path.join(world_path, 'db', '000005.ldb'), 'wb') as file:
+        file.write(content)
+
+    result = backup.create('chunk-server', 'level-1', 'chunk-backup-1', chunked=True)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, 'chunk-backup-1.properties'))
+    assert result[1] == 0
+    assert len([key for key in result[0] if key.startswith('chunks.')]) == 1
+    chunks_1 = set(result[0][[key for key in result[0] if key.startswith('chunks.')][0]].split(','))
+
+    changed = content[:len(content) // 2] + b'inserted' + content[len(content) // 2:]
+    with open(os.path.join(world_path, 'db', '000005.ldb'), 'wb') as file:
+        file.write(changed)
+    result = backup.create('chunk-server', 'level-1', 'chunk-backup-2', chunked=True)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    result = helpers.read_properties(os.path.join(settings.BACKUPS_PATH, 'chunk-backup-2.properties'))
+    chunks_2 = set(result[0][[key for key in result[0] if key.startswith('chunks.')][0]].split(','))
+    assert len(chunks_2 - chunks_1) <= 2  # only the chunks around the insert are new
+
+    result = backup.restore('chunk-backup-1', 'chunk-server', 'level-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['strategies']['db/000005.ldb'] == 'chunks'
+    with open(os.path.join(world_path, 'db', '000005.ldb'), 'rb') as file:
+        assert file.read() == content
+
+    assert backup.remove('chunk-backup-1')[1] == 0
+    result = backup.restore('chunk-backup-2', 'chunk-server', 'level-1')
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    with open(os.path.join(world_path, 'db', '000005.ldb'), 'rb') as file:
+        assert file.read() == changed
+
+    assert backup.remove('chunk-backup-2')[1] == 0
+    shutil.rmtree(server_path)  # never started, so there is no log for server.remove()
+
+def test_backup_all_server():
+    before = set(backup.list()[0])
+    result = backup.all_server(workers=1, max_bandwidth=100 * 1024 * 1024)
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    scheduled = result[0]['backed-up'] + result[0]['still-running'] + result[0]['failed']
+    assert sorted(scheduled) == sorted(server.get_created())
+    assert sorted(entry['position'] for entry in result[0]['schedule'].values()) == list(range(len(scheduled)))
+    for entry in result[0]['schedule'].values():
+        assert entry['queue-wait'] >= 0
+        assert entry['execution'] >= 0
+        assert entry['queue-wait'] <= result[0]['times']
+
+    result = backup.remove_batch(list(set(backup.list()[0]) - before))
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+
 def test_remove_backup():
     result = backup.remove()
     assert isinstance(result, tuple)
@@ -683,6 +1290,16 @@ def test_remove_backup():
     assert isinstance(result, tuple)
     assert result[1] == 2042  # backup not exists
 
+    result = backup.remove_batch()
+    assert isinstance(result, tuple)
+    assert result[1] == 2091  # backup-names are required
+
+    result = backup.remove_batch(['blubb'])
+    assert isinstance(result, tuple)
+    assert result[1] == 0
+    assert result[0]['not-found'] == ['blubb']
+    assert result[0]['removed-blobs'] == 0
+
 def test_remove_server():
     result = server.remove('test-server-1')
     assert isinstance(result, tuple)